@@ -0,0 +1,206 @@
+"""Online backups of the queue database using SQLite's backup API.
+
+Snapshots are copied a few pages at a time, pausing in the progress callback after
+each step, so the live bot's writers can take the lock while a backup is in progress.
+A write from another connection makes SQLite restart the copy; after a few restarts
+the rest is copied in a single step so a busy database still gets backed up.
+
+Usage:
+    python backup.py create [--db queue.db] [--dir backups] [--keep 7]
+    python backup.py list [--dir backups]
+    python backup.py verify <snapshot>
+    python backup.py restore <snapshot> [--db queue.db]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = 'queue-'
+SNAPSHOT_SUFFIX = '.db'
+DEFAULT_PAGES = 64
+DEFAULT_STEP_SLEEP = 0.005
+DEFAULT_MAX_RESTARTS = 3
+DEFAULT_TIMEOUT = 300.0
+
+
+class _CopyRestarted(Exception):
+    """Raised from the progress callback to abandon a stepped copy that keeps restarting"""
+
+
+def copy_database(src_path: str, dest_path: str, pages: int = DEFAULT_PAGES, step_sleep: float = DEFAULT_STEP_SLEEP,
+                  max_restarts: int = DEFAULT_MAX_RESTARTS, timeout: float = DEFAULT_TIMEOUT):
+    """Copy src to dest in page-sized steps, sleeping between steps so other connections can write.
+
+    After max_restarts restarts caused by concurrent writes, the rest is copied in one step,
+    which holds a read lock for the whole copy but cannot be restarted. Raises TimeoutError
+    if the copy takes longer than timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    restarts = 0
+    last_remaining = None
+
+    def check_deadline(status, remaining, total):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Backup of {src_path} did not finish within {timeout:g}s")
+
+    def pause(status, remaining, total):
+        nonlocal restarts, last_remaining
+        check_deadline(status, remaining, total)
+        # SQLite starts over from the first page when another connection writes to src
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts >= max_restarts:
+                raise _CopyRestarted()
+        last_remaining = remaining
+        # backup()'s own sleep= only applies after SQLITE_BUSY/LOCKED, so yield here instead
+        if remaining:
+            time.sleep(step_sleep)
+
+    src = sqlite3.connect(src_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        try:
+            src.backup(dest, pages=pages, progress=pause)
+        except _CopyRestarted:
+            logger.warning("Backup of %s restarted %d times under concurrent writes; copying it in one step",
+                           src_path, restarts)
+            src.backup(dest, pages=-1, progress=check_deadline)
+    finally:
+        dest.close()
+        src.close()
+
+
+def verify_snapshot(path: str) -> dict:
+    """Run an integrity check on a snapshot and return row counts. Raises ValueError if it is unusable."""
+    if not os.path.exists(path):
+        raise ValueError(f"Snapshot not found: {path}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA integrity_check')
+        result = cursor.fetchone()[0]
+        if result != 'ok':
+            raise ValueError(f"Integrity check failed for {path}: {result}")
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('queue', 'users')")
+        tables = {row[0] for row in cursor.fetchall()}
+        missing = {'queue', 'users'} - tables
+        if missing:
+            raise ValueError(f"Snapshot {path} is missing tables: {', '.join(sorted(missing))}")
+        cursor.execute("SELECT COUNT(*) FROM queue WHERE status = 'pending'")
+        pending = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM queue')
+        total = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM users')
+        users = cursor.fetchone()[0]
+        return {'pending': pending, 'items': total, 'users': users}
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Snapshot {path} is not a valid database: {e}")
+    finally:
+        conn.close()
+
+
+def list_snapshots(backup_dir: str) -> List[str]:
+    """Return snapshot paths in backup_dir, oldest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    ]
+    return [os.path.join(backup_dir, name) for name in sorted(names)]
+
+
+def rotate_snapshots(backup_dir: str, keep: int) -> List[str]:
+    """Delete the oldest snapshots beyond `keep`. Returns the removed paths."""
+    snapshots = list_snapshots(backup_dir)
+    if keep <= 0 or len(snapshots) <= keep:
+        return []
+    removed = []
+    for path in snapshots[:-keep]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError as e:
+            logger.error("Could not remove old snapshot %s: %s", path, e)
+    return removed
+
+
+def create_snapshot(db_path: str, backup_dir: str, keep: int = 7,
+                    pages: int = DEFAULT_PAGES, step_sleep: float = DEFAULT_STEP_SLEEP) -> str:
+    """Write a verified, timestamped snapshot of db_path into backup_dir and rotate old ones"""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    final_path = os.path.join(backup_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+    partial_path = final_path + '.partial'
+
+    try:
+        copy_database(db_path, partial_path, pages, step_sleep)
+        verify_snapshot(partial_path)
+        os.replace(partial_path, final_path)
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    for path in rotate_snapshots(backup_dir, keep):
+        logger.info("Rotated out snapshot %s", path)
+    logger.info("Wrote database snapshot %s", final_path)
+    return final_path
+
+
+def restore_snapshot(snapshot_path: str, db_path: str, pages: int = DEFAULT_PAGES,
+                     step_sleep: float = DEFAULT_STEP_SLEEP) -> dict:
+    """Verify a snapshot and copy it over the live database through the backup API"""
+    counts = verify_snapshot(snapshot_path)
+    copy_database(snapshot_path, db_path, pages, step_sleep)
+    logger.info("Restored %s from snapshot %s", db_path, snapshot_path)
+    return counts
+
+
+def _main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Create, verify and restore queue database snapshots')
+    sub = parser.add_subparsers(dest='action', required=True)
+
+    create = sub.add_parser('create', help='write a new snapshot')
+    create.add_argument('--db', default=os.getenv('QUEUE_DB_PATH', 'queue.db'))
+    create.add_argument('--dir', default=os.getenv('BACKUP_DIR', 'backups'))
+    create.add_argument('--keep', type=int, default=int(os.getenv('BACKUP_KEEP', '7')))
+
+    listing = sub.add_parser('list', help='list snapshots, oldest first')
+    listing.add_argument('--dir', default=os.getenv('BACKUP_DIR', 'backups'))
+
+    verify = sub.add_parser('verify', help='integrity-check a snapshot')
+    verify.add_argument('snapshot')
+
+    restore = sub.add_parser('restore', help='verify a snapshot and restore it over the database')
+    restore.add_argument('snapshot')
+    restore.add_argument('--db', default=os.getenv('QUEUE_DB_PATH', 'queue.db'))
+
+    args = parser.parse_args(argv)
+    try:
+        if args.action == 'create':
+            print(create_snapshot(args.db, args.dir, args.keep))
+        elif args.action == 'list':
+            for path in list_snapshots(args.dir):
+                print(f"{path}\t{os.path.getsize(path)} bytes")
+        elif args.action == 'verify':
+            counts = verify_snapshot(args.snapshot)
+            print(f"OK: {counts['items']} items ({counts['pending']} pending), {counts['users']} users")
+        elif args.action == 'restore':
+            counts = restore_snapshot(args.snapshot, args.db)
+            print(f"Restored {args.db}: {counts['items']} items ({counts['pending']} pending), {counts['users']} users")
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
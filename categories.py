@@ -0,0 +1,42 @@
+"""In-memory registry of queue categories, loaded from the categories table.
+
+Request messages are classified with one precompiled matcher for "(tag)" groups plus
+a dict lookup on the tag, so the cost stays flat as categories are added.
+"""
+import re
+
+# Names are used in "(name)" tags, command arguments and settings keys
+CATEGORY_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+_TAG = re.compile(r'\(([A-Za-z0-9_-]{1,32})\)')
+
+
+class CategoryRegistry:
+    """Ordered category names with membership checks and request classification"""
+
+    def __init__(self, names=()):
+        self.load(names)
+
+    def load(self, names):
+        self.names = [name.lower() for name in names]
+        self._lookup = {name: name for name in self.names}
+
+    def __contains__(self, name) -> bool:
+        return name in self._lookup
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def choices(self) -> str:
+        """Names joined for usage strings, e.g. 'show|movie|anime'"""
+        return '|'.join(self.names)
+
+    def classify(self, content: str):
+        """Return (category, title before the tag) for the first "(category)" tag in content, else (None, None)"""
+        for match in _TAG.finditer(content):
+            category = self._lookup.get(match.group(1).lower())
+            if category:
+                return category, content[:match.start()].strip()
+        return None, None
@@ -1,12 +1,92 @@
 import sqlite3
 import os
+import logging
+import threading
 from datetime import datetime
 from typing import List, Tuple
+from migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+ORDER_FIFO = 'fifo'
+ORDER_FAIR = 'fair'
+
+class ChangeSubscription:
+    """A consumer's cursor into the queue change feed.
+
+    Call poll() to fetch events after the cursor; on_change (if given) is invoked after every
+    committed mutation, possibly from a worker thread, so consumers know when to poll.
+    """
+    def __init__(self, db, cursor: int, on_change=None):
+        self.db = db
+        self.cursor = cursor
+        self.on_change = on_change
+
+    def poll(self, limit: int = 500) -> List[Tuple]:
+        """Return (seq, event, item_id, category, created, guild_id) rows after the cursor and advance it"""
+        events = self.db.get_events_since(self.cursor, limit)
+        if events:
+            self.cursor = events[-1][0]
+        return events
+
+    def close(self):
+        self.db.unsubscribe(self)
+
+    def _notify(self):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change()
+        except Exception as e:
+            logger.error("Change feed subscriber failed: %s", e)
 
 class QueueDatabase:
-    def __init__(self, db_path: str = 'queue.db'):
+    def __init__(self, db_path: str = 'queue.db', fair_share_categories=None):
         self.db_path = db_path
+        self.fair_share_categories = set(fair_share_categories or ())
+        # get_queue results keyed by (guild_id, category); dropped when the change feed touches that scope.
+        # Mutations can commit on another thread mid-query, so each scope carries a version and
+        # get_queue only stores a result if nothing was invalidated while it was reading.
+        self._queue_cache = {}
+        self._cache_versions = {}
+        self._cache_lock = threading.Lock()
+        self._subscriptions = []
+        # Per-guild ordering overrides; fair_share_categories is the default for guilds without one
+        self._guild_ordering = {}
         self.init_database()
+        self._load_guild_ordering()
+
+    def _invalidate(self, cache_keys=None):
+        """Drop cached get_queue results for these (guild_id, category) keys, or all of them"""
+        with self._cache_lock:
+            if cache_keys is None:
+                # The None key versions the whole cache
+                cache_keys = {None} | set(self._queue_cache)
+            for cache_key in cache_keys:
+                self._cache_versions[cache_key] = self._cache_versions.get(cache_key, 0) + 1
+                self._queue_cache.pop(cache_key, None)
+
+    def _publish(self, scopes):
+        """Drop cached views of changed (guild_id, category) scopes and wake change-feed subscribers"""
+        self._invalidate({key for guild_id, category in scopes for key in ((guild_id, category), (guild_id, None))})
+        for subscription in list(self._subscriptions):
+            subscription._notify()
+
+    def _load_guild_ordering(self):
+        for guild_id, key, value in self.get_settings_like('ORDERING_%'):
+            self._guild_ordering[(guild_id, key[len('ORDERING_'):].lower())] = value
+
+    def set_ordering(self, category: str, mode: str, guild_id: str = ''):
+        """Select FIFO or fair-share (per-user round-robin) ordering for a category in a guild"""
+        self._guild_ordering[(guild_id, category)] = mode
+        self.set_guild_setting(guild_id, f'ORDERING_{category.upper()}', mode)
+        self._invalidate({(guild_id, category)})
+
+    def get_ordering(self, category: str, guild_id: str = '') -> str:
+        mode = self._guild_ordering.get((guild_id, category))
+        if mode:
+            return mode
+        return ORDER_FAIR if category in self.fair_share_categories else ORDER_FIFO
 
     def _vacuum_safe(self):
         """Attempt to reclaim space; ignore failures so callers can proceed."""
@@ -17,62 +97,115 @@ class QueueDatabase:
             conn.commit()
             conn.close()
         except Exception as e:
-            print(f"VACUUM failed: {e}")
+            logger.error("VACUUM failed: %s", e)
 
     def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create queue table
+        """Bring the schema up to date (a single PRAGMA read when it already is)"""
+        migrate(self.db_path)
+    
+    def _log_action(self, cursor, user_id: str, action: str, item_id: int,
+                    prev_status: str = None, prev_downloading: int = None):
+        """Append an undoable action for a user inside the caller's transaction"""
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS queue (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                category TEXT NOT NULL,
-                added_by TEXT NOT NULL,
-                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                status_note TEXT DEFAULT '',
-                is_downloading INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # Create users table for tracking contributions
+            INSERT INTO user_actions (user_id, seq, action, item_id, prev_status, prev_downloading)
+            VALUES (?, (SELECT MAX(COALESCE(MAX(seq), 0), 0) + 1 FROM user_actions WHERE user_id = ?), ?, ?, ?, ?)
+        ''', (user_id, user_id, action, item_id, prev_status, prev_downloading))
+
+    def _record_event(self, cursor, event: str, item_id: int, category: str, guild_id: str = ''):
+        """Append a change-feed event inside the caller's transaction"""
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                username TEXT NOT NULL,
-                items_added INTEGER DEFAULT 0,
-                last_added TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
+            INSERT INTO queue_events (event, item_id, category, guild_id)
+            VALUES (?, ?, ?, ?)
+        ''', (event, item_id, category, guild_id))
 
-        # Backfill missing columns for existing databases
-        self._ensure_column(cursor, 'queue', 'status_note', "TEXT DEFAULT ''")
-        self._ensure_column(cursor, 'queue', 'is_downloading', "INTEGER DEFAULT 0")
+    def _record_item_event(self, cursor, event: str, item_id: int) -> Tuple:
+        """Record an event for an existing item, looking up its scope. Returns (guild_id, category)."""
+        cursor.execute('SELECT guild_id, category FROM queue WHERE id = ?', (item_id,))
+        guild_id, category = cursor.fetchone()
+        self._record_event(cursor, event, item_id, category, guild_id)
+        return guild_id, category
 
-        conn.commit()
-        conn.close()
+    def get_events_since(self, after_seq: int, limit: int = 500) -> List[Tuple]:
+        """Return change-feed events with seq > after_seq, oldest first"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT seq, event, item_id, category, created, guild_id
+                FROM queue_events
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+            ''', (after_seq, limit))
+            
+            results = cursor.fetchall()
+            conn.close()
+            return results
+        except Exception as e:
+            logger.error("Error reading change feed: %s", e)
+            return []
 
-    def _ensure_column(self, cursor, table: str, column: str, definition: str):
-        """Add a column if it doesn't already exist (SQLite)"""
-        cursor.execute(f"PRAGMA table_info({table})")
-        columns = [row[1] for row in cursor.fetchall()]
-        if column not in columns:
-            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-    
-    def _insert_queue_row(self, title: str, category: str, user_id: str, username: str) -> int:
+    def latest_event_seq(self) -> int:
+        """Return the newest change-feed seq, or 0 if nothing has happened yet"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM queue_events')
+            result = cursor.fetchone()[0]
+            conn.close()
+            return result
+        except Exception as e:
+            logger.error("Error reading change feed: %s", e)
+            return 0
+
+    def trim_change_feed(self, retention_days: float, batch_size: int = 500) -> int:
+        """Delete up to batch_size of the oldest change-feed events older than retention_days. Returns count deleted."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            # seq grows with created, so the expired events are a prefix of the table
+            cursor.execute('''
+                SELECT MAX(seq) FROM (
+                    SELECT seq, created FROM queue_events ORDER BY seq LIMIT ?
+                )
+                WHERE created < datetime('now', ?)
+            ''', (batch_size, f'-{retention_days} days'))
+            cutoff = cursor.fetchone()[0]
+            deleted = 0
+            if cutoff is not None:
+                cursor.execute('DELETE FROM queue_events WHERE seq <= ?', (cutoff,))
+                deleted = cursor.rowcount
+            
+            conn.commit()
+            conn.close()
+            return deleted
+        except Exception as e:
+            logger.error("Error trimming change feed: %s", e)
+            return 0
+
+    def subscribe(self, from_seq: int = None, on_change=None) -> ChangeSubscription:
+        """Start tailing the change feed after from_seq (default: only events from now on)"""
+        if from_seq is None:
+            from_seq = self.latest_event_seq()
+        subscription = ChangeSubscription(self, from_seq, on_change)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChangeSubscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def _insert_queue_row(self, title: str, category: str, user_id: str, username: str, guild_id: str = '') -> int:
         """Shared insert logic so we can retry on disk-full errors."""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO queue (title, category, added_by)
-            VALUES (?, ?, ?)
-        ''', (title, category, user_id))
+            INSERT INTO queue (title, category, added_by, guild_id)
+            VALUES (?, ?, ?, ?)
+        ''', (title, category, user_id, guild_id))
         
         item_id = cursor.lastrowid
         
@@ -84,97 +217,188 @@ class QueueDatabase:
                 last_added = CURRENT_TIMESTAMP
         ''', (user_id, username))
         
+        self._log_action(cursor, user_id, 'add', item_id)
+        self._record_event(cursor, 'add', item_id, category, guild_id)
+        
         conn.commit()
+        self._publish([(guild_id, category)])
         conn.close()
         return item_id
 
-    def add_to_queue(self, title: str, category: str, user_id: str, username: str) -> int:
+    def add_to_queue(self, title: str, category: str, user_id: str, username: str, guild_id: str = '') -> int:
         """Add an item to the queue and return the item ID. Retries once after VACUUM on disk-full errors."""
         try:
-            return self._insert_queue_row(title, category, user_id, username)
+            return self._insert_queue_row(title, category, user_id, username, guild_id)
         except sqlite3.OperationalError as e:
             # SQLite returns this when the DB file or disk quota is full; try to compact once then retry
             if "database or disk is full" in str(e).lower():
-                print("Database full; attempting VACUUM and retry...")
+                logger.warning("Database full; attempting VACUUM and retry...")
                 self._vacuum_safe()
                 try:
-                    return self._insert_queue_row(title, category, user_id, username)
+                    return self._insert_queue_row(title, category, user_id, username, guild_id)
                 except Exception as retry_err:
-                    print(f"Retry after VACUUM failed: {retry_err}")
+                    logger.error("Retry after VACUUM failed: %s", retry_err)
                     return None
-            print(f"Error adding to queue: {e}")
+            logger.error("Error adding to queue: %s", e)
             return None
         except Exception as e:
-            print(f"Error adding to queue: {e}")
+            logger.error("Error adding to queue: %s", e)
             return None
     
-    def get_queue(self, category: str = None) -> List[Tuple]:
-        """Get all non-completed items from the queue, optionally filtered by category"""
+    def get_queue(self, category: str = None, guild_id: str = '') -> List[Tuple]:
+        """Get all non-completed items in a guild's queue, optionally filtered by category.
+
+        Downloading items always come first. Categories using fair-share ordering then
+        interleave pending items round-robin by requester instead of strict FIFO.
+        """
+        cache_key = (guild_id, category)
+        with self._cache_lock:
+            cached = self._queue_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+            version = (self._cache_versions.get(None, 0), self._cache_versions.get(cache_key, 0))
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            if category:
+            if category and self.get_ordering(category, guild_id) == ORDER_FAIR:
+                cursor.execute('''
+                    SELECT id, title, category, added_by, added_date, status, status_note, is_downloading
+                    FROM (
+                        SELECT id, title, category, added_by, added_date, status, status_note, is_downloading,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY is_downloading, added_by
+                                   ORDER BY added_date, id
+                               ) AS user_turn
+                        FROM queue
+                        WHERE guild_id = ? AND status = 'pending' AND category = ?
+                    )
+                    ORDER BY is_downloading DESC,
+                             CASE WHEN is_downloading = 1 THEN 0 ELSE user_turn END,
+                             added_date, id
+                ''', (guild_id, category))
+            elif category:
                 cursor.execute('''
                     SELECT id, title, category, added_by, added_date, status, status_note, is_downloading
                     FROM queue
-                    WHERE status = 'pending' AND category = ?
+                    WHERE guild_id = ? AND status = 'pending' AND category = ?
                     ORDER BY is_downloading DESC, added_date
-                ''', (category,))
+                ''', (guild_id, category))
             else:
                 cursor.execute('''
                     SELECT id, title, category, added_by, added_date, status, status_note, is_downloading
                     FROM queue
-                    WHERE status = 'pending'
+                    WHERE guild_id = ? AND status = 'pending'
                     ORDER BY is_downloading DESC, added_date
-                ''')
+                ''', (guild_id,))
             
             results = cursor.fetchall()
             conn.close()
-            return results
+            with self._cache_lock:
+                if (self._cache_versions.get(None, 0), self._cache_versions.get(cache_key, 0)) == version:
+                    self._queue_cache[cache_key] = results
+            return list(results)
         except Exception as e:
-            print(f"Error getting queue: {e}")
+            logger.error("Error getting queue: %s", e)
             return []
     
-    def remove_from_queue(self, item_id: int) -> bool:
-        """Remove or mark an item as completed"""
+    def remove_from_queue(self, item_id: int, user_id: str = None) -> bool:
+        """Remove or mark an item as completed. Logged for !undo when user_id is given."""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            cursor.execute('SELECT status, category, guild_id FROM queue WHERE id = ?', (item_id,))
+            row = cursor.fetchone()
+            
             cursor.execute('''
                 UPDATE queue
                 SET status = 'completed'
                 WHERE id = ?
             ''', (item_id,))
             
+            if row and row[0] != 'completed':
+                self._record_event(cursor, 'remove', item_id, row[1], row[2])
+                if user_id and row[0] == 'pending':
+                    self._log_action(cursor, user_id, 'remove', item_id, prev_status=row[0])
+            
             conn.commit()
+            self._publish([(row[2], row[1])] if row else [])
             conn.close()
             return True
         except Exception as e:
-            print(f"Error removing from queue: {e}")
+            logger.error("Error removing from queue: %s", e)
             return False
     
-    def clear_queue(self, category: str) -> int:
-        """Mark all pending items in a category as completed. Returns count cleared."""
+    def clear_queue(self, category: str, guild_id: str = '') -> int:
+        """Mark all pending items in a guild's category as completed. Returns count cleared."""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            cursor.execute('''
+                INSERT INTO queue_events (event, item_id, category, guild_id)
+                SELECT 'remove', id, category, guild_id
+                FROM queue
+                WHERE guild_id = ? AND status = 'pending' AND category = ?
+            ''', (guild_id, category))
+            
             cursor.execute('''
                 UPDATE queue
                 SET status = 'completed'
-                WHERE status = 'pending' AND category = ?
-            ''', (category,))
+                WHERE guild_id = ? AND status = 'pending' AND category = ?
+            ''', (guild_id, category))
             
             cleared = cursor.rowcount
             conn.commit()
+            self._publish([(guild_id, category)])
             conn.close()
             return cleared
         except Exception as e:
-            print(f"Error clearing queue: {e}")
+            logger.error("Error clearing queue: %s", e)
             return 0
     
+    def expire_stale_items(self, category: str, max_age_days: float, new_status: str = 'completed',
+                           batch_size: int = 100) -> Tuple[int, set]:
+        """Move up to batch_size non-downloading pending items older than max_age_days to new_status.
+
+        Applies to the category in every guild. Returns (rows changed, {(guild_id, category)} touched);
+        callers loop until the count drops below batch_size.
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, guild_id FROM queue
+                WHERE status = 'pending' AND category = ?
+                  AND added_date < datetime('now', ?)
+                  AND is_downloading = 0
+                ORDER BY added_date
+                LIMIT ?
+            ''', (category, f'-{max_age_days} days', batch_size))
+            rows = cursor.fetchall()
+            item_ids = [row[0] for row in rows]
+            
+            cursor.executemany('''
+                UPDATE queue SET status = ?
+                WHERE id = ? AND status = 'pending'
+            ''', [(new_status, item_id) for item_id in item_ids])
+            cursor.executemany('''
+                INSERT INTO queue_events (event, item_id, category, guild_id)
+                VALUES ('expire', ?, ?, ?)
+            ''', [(item_id, category, guild_id) for item_id, guild_id in rows])
+            
+            expired = len(item_ids)
+            scopes = {(guild_id, category) for _, guild_id in rows}
+            conn.commit()
+            self._publish(scopes)
+            conn.close()
+            return expired, scopes
+        except Exception as e:
+            logger.error("Error expiring stale items: %s", e)
+            return 0, set()
+    
     def get_item(self, item_id: int):
         """Fetch a single queue item by id"""
         try:
@@ -191,47 +415,92 @@ class QueueDatabase:
             conn.close()
             return result
         except Exception as e:
-            print(f"Error fetching item: {e}")
+            logger.error("Error fetching item: %s", e)
             return None
     
-    def undo_last_entry(self, user_id: str) -> Tuple:
-        """Remove the last entry added by a user and return the item info"""
+    def undo_actions(self, user_id: str, count: int = 1) -> List[Tuple]:
+        """Revert a user's last `count` adds, removes and toggles in one transaction.
+
+        Returns (item_id, title, category, action, guild_id) for each reverted action, newest first.
+        Actions whose item has since moved on (e.g. an add that was already completed)
+        are consumed without changing the item and do not count towards `count`.
+        """
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
             
-            # Get the last pending item added by this user
-            cursor.execute('''
-                SELECT id, title, category
-                FROM queue
-                WHERE added_by = ? AND status = 'pending'
-                ORDER BY added_date DESC
-                LIMIT 1
-            ''', (user_id,))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                item_id = result[0]
-                # Delete the item
-                cursor.execute('DELETE FROM queue WHERE id = ?', (item_id,))
-                
-                # Update user stats
+            reverted = []
+            actions = True
+            while actions and len(reverted) < count:
+                # Every action read below is marked undone, so each pass reads the next ones
                 cursor.execute('''
-                    UPDATE users
-                    SET items_added = items_added - 1
-                    WHERE user_id = ?
-                ''', (user_id,))
-                
-                conn.commit()
-                conn.close()
-                return result
+                    SELECT seq, action, item_id, prev_status, prev_downloading
+                    FROM user_actions INDEXED BY idx_user_actions_live
+                    WHERE user_id = ? AND undone = 0
+                    ORDER BY seq DESC
+                    LIMIT ?
+                ''', (user_id, count - len(reverted)))
+                actions = cursor.fetchall()
+                reverted.extend(self._revert_actions(cursor, user_id, actions))
             
+            conn.commit()
+            self._publish({(item[4], item[2]) for item in reverted})
             conn.close()
-            return None
+            return reverted
         except Exception as e:
-            print(f"Error undoing entry: {e}")
-            return None
+            logger.error("Error undoing actions: %s", e)
+            return []
+    
+    def _revert_actions(self, cursor, user_id: str, actions) -> List[Tuple]:
+        """Revert and consume logged actions; returns the ones that changed their item"""
+        reverted = []
+        for seq, action, item_id, prev_status, prev_downloading in actions:
+            if action == 'add':
+                cursor.execute('''
+                    UPDATE queue SET status = 'undone'
+                    WHERE id = ? AND status = 'pending'
+                ''', (item_id,))
+                changed = cursor.rowcount > 0
+                if changed:
+                    cursor.execute('''
+                        UPDATE users
+                        SET items_added = items_added - 1
+                        WHERE user_id = ?
+                    ''', (user_id,))
+            elif action == 'remove':
+                cursor.execute('''
+                    UPDATE queue SET status = ?
+                    WHERE id = ? AND status = 'completed'
+                ''', (prev_status, item_id))
+                changed = cursor.rowcount > 0
+            elif action == 'toggle':
+                cursor.execute('''
+                    UPDATE queue SET is_downloading = ?
+                    WHERE id = ? AND status = 'pending'
+                ''', (prev_downloading, item_id))
+                changed = cursor.rowcount > 0
+            else:
+                changed = False
+            
+            cursor.execute('''
+                UPDATE user_actions SET undone = 1
+                WHERE user_id = ? AND seq = ?
+            ''', (user_id, seq))
+            
+            if changed:
+                cursor.execute('SELECT title, category, guild_id FROM queue WHERE id = ?', (item_id,))
+                title, category, guild_id = cursor.fetchone()
+                self._record_event(cursor, 'undo', item_id, category, guild_id)
+                reverted.append((item_id, title, category, action, guild_id))
+        return reverted
+    
+    def undo_last_entry(self, user_id: str) -> Tuple:
+        """Undo the user's last action and return (item_id, title, category), or None"""
+        reverted = self.undo_actions(user_id, 1)
+        if reverted:
+            return reverted[0][:3]
+        return None
     
     def get_user_stats(self, user_id: str) -> Tuple:
         """Get user contribution statistics"""
@@ -249,27 +518,30 @@ class QueueDatabase:
             conn.close()
             return result
         except Exception as e:
-            print(f"Error getting user stats: {e}")
+            logger.error("Error getting user stats: %s", e)
             return None
     
-    def get_queue_stats(self) -> dict:
-        """Get overall queue statistics"""
+    def get_queue_stats(self, guild_id: str = None) -> dict:
+        """Get queue statistics for one guild, or across all guilds when guild_id is None"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            cursor.execute('SELECT COUNT(*) FROM queue WHERE status = "pending"')
+            scope = '' if guild_id is None else 'AND guild_id = ?'
+            params = () if guild_id is None else (guild_id,)
+            
+            cursor.execute(f"SELECT COUNT(*) FROM queue WHERE status = 'pending' {scope}", params)
             pending = cursor.fetchone()[0]
             
-            cursor.execute('SELECT COUNT(*) FROM queue WHERE status = "completed"')
+            cursor.execute(f"SELECT COUNT(*) FROM queue WHERE status = 'completed' {scope}", params)
             completed = cursor.fetchone()[0]
             
-            cursor.execute('''
-                SELECT category, COUNT(*) as count
+            cursor.execute(f'''
+                SELECT category, COUNT(*) as count, SUM(is_downloading = 1) as downloading
                 FROM queue
-                WHERE status = 'pending'
+                WHERE status = 'pending' {scope}
                 GROUP BY category
-            ''')
+            ''', params)
             by_category = cursor.fetchall()
             
             conn.close()
@@ -277,10 +549,11 @@ class QueueDatabase:
             return {
                 'pending': pending,
                 'completed': completed,
-                'by_category': {cat: count for cat, count in by_category}
+                'by_category': {cat: count for cat, count, _ in by_category},
+                'downloading_by_category': {cat: downloading for cat, _, downloading in by_category}
             }
         except Exception as e:
-            print(f"Error getting queue stats: {e}")
+            logger.error("Error getting queue stats: %s", e)
             return {}
 
     def set_status_note(self, item_id: int, note: str) -> bool:
@@ -294,12 +567,16 @@ class QueueDatabase:
                 SET status_note = ?
                 WHERE id = ? AND status = 'pending'
             ''', (note, item_id))
+            updated = cursor.rowcount > 0
+            
+            scope = self._record_item_event(cursor, 'status', item_id) if updated else None
             
             conn.commit()
+            self._publish([scope] if scope else [])
             conn.close()
-            return cursor.rowcount > 0
+            return updated
         except Exception as e:
-            print(f"Error setting status note: {e}")
+            logger.error("Error setting status note: %s", e)
             return False
 
     def clear_status_note(self, item_id: int) -> bool:
@@ -313,29 +590,274 @@ class QueueDatabase:
                 SET status_note = ''
                 WHERE id = ? AND status = 'pending'
             ''', (item_id,))
+            updated = cursor.rowcount > 0
+            
+            scope = self._record_item_event(cursor, 'status', item_id) if updated else None
             
             conn.commit()
+            self._publish([scope] if scope else [])
             conn.close()
-            return cursor.rowcount > 0
+            return updated
         except Exception as e:
-            print(f"Error clearing status note: {e}")
+            logger.error("Error clearing status note: %s", e)
             return False
 
-    def toggle_downloading(self, item_id: int) -> bool:
-        """Toggle the downloading flag for an item"""
+    def toggle_downloading(self, item_id: int, user_id: str = None) -> bool:
+        """Toggle the downloading flag for an item. Logged for !undo when user_id is given."""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            cursor.execute('''
+                SELECT is_downloading, category, guild_id FROM queue
+                WHERE id = ? AND status = 'pending'
+            ''', (item_id,))
+            row = cursor.fetchone()
+            
             cursor.execute('''
                 UPDATE queue
                 SET is_downloading = CASE WHEN is_downloading = 1 THEN 0 ELSE 1 END
                 WHERE id = ? AND status = 'pending'
             ''', (item_id,))
+            toggled = cursor.rowcount > 0
+            
+            if toggled:
+                self._record_event(cursor, 'toggle', item_id, row[1], row[2])
+                if user_id:
+                    self._log_action(cursor, user_id, 'toggle', item_id, prev_downloading=row[0])
+            
+            conn.commit()
+            self._publish([(row[2], row[1])] if toggled else [])
+            conn.close()
+            return toggled
+        except Exception as e:
+            logger.error("Error toggling downloading: %s", e)
+            return False
+
+    def ping(self) -> bool:
+        """Check that the database file can be opened and queried. Raises on failure."""
+        # mode=rw so a missing file fails the check instead of being recreated empty
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=rw", uri=True, timeout=2)
+        try:
+            conn.execute('SELECT 1 FROM queue LIMIT 1').fetchall()
+            return True
+        finally:
+            conn.close()
+
+    def get_guild_settings(self, guild_id: str) -> dict:
+        """Return all stored settings for a guild as {key: value}"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT key, value FROM guild_settings
+                WHERE guild_id = ?
+            ''', (guild_id,))
+            
+            results = dict(cursor.fetchall())
+            conn.close()
+            return results
+        except Exception as e:
+            logger.error("Error getting guild settings: %s", e)
+            return {}
+
+    def get_settings_like(self, pattern: str) -> List[Tuple]:
+        """Return (guild_id, key, value) for every guild setting whose key matches a LIKE pattern"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT guild_id, key, value FROM guild_settings
+                WHERE key LIKE ?
+            ''', (pattern,))
+            
+            results = cursor.fetchall()
+            conn.close()
+            return results
+        except Exception as e:
+            logger.error("Error getting guild settings: %s", e)
+            return []
+
+    def set_guild_setting(self, guild_id: str, key: str, value: str) -> bool:
+        """Write or replace a single guild setting"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO guild_settings (guild_id, key, value)
+                VALUES (?, ?, ?)
+                ON CONFLICT(guild_id, key) DO UPDATE SET value = excluded.value
+            ''', (guild_id, key, value))
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error("Error setting guild setting: %s", e)
+            return False
+
+    def delete_guild_settings(self, guild_id: str, prefix: str) -> int:
+        """Delete a guild's settings whose key starts with prefix. Returns count deleted."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                DELETE FROM guild_settings
+                WHERE guild_id = ? AND substr(key, 1, ?) = ?
+            ''', (guild_id, len(prefix), prefix))
+            
+            deleted = cursor.rowcount
+            conn.commit()
+            conn.close()
+            return deleted
+        except Exception as e:
+            logger.error("Error deleting guild settings: %s", e)
+            return 0
+
+    def delete_guild_setting_keys(self, guild_id: str, keys) -> int:
+        """Delete specific settings of a guild. Returns count deleted."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.executemany('DELETE FROM guild_settings WHERE guild_id = ? AND key = ?',
+                               [(guild_id, key) for key in keys])
+            
+            deleted = cursor.rowcount
+            conn.commit()
+            conn.close()
+            return deleted
+        except Exception as e:
+            logger.error("Error deleting guild settings: %s", e)
+            return 0
+
+    def get_categories(self) -> List[str]:
+        """Return category names in display order"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT name FROM categories ORDER BY position, name')
+            
+            results = [row[0] for row in cursor.fetchall()]
+            conn.close()
+            return results
+        except Exception as e:
+            logger.error("Error getting categories: %s", e)
+            return []
+
+    def add_category(self, name: str) -> bool:
+        """Append a category after the existing ones. Returns False if it already exists."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR IGNORE INTO categories (name, position)
+                SELECT ?, COALESCE(MAX(position), 0) + 1 FROM categories
+            ''', (name,))
             
+            added = cursor.rowcount > 0
             conn.commit()
             conn.close()
-            return cursor.rowcount > 0
+            return added
         except Exception as e:
-            print(f"Error toggling downloading: {e}")
+            logger.error("Error adding category: %s", e)
             return False
+
+    def remove_category(self, name: str) -> bool:
+        """Drop a category from the registry; its queue rows are kept in case it is added back"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM categories WHERE name = ?', (name,))
+            
+            removed = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            return removed
+        except Exception as e:
+            logger.error("Error removing category: %s", e)
+            return False
+
+    def add_embed_mirror(self, guild_id: str, category: str, channel_id: str, message_id: str) -> bool:
+        """Register another message that mirrors a guild's category queue embed"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO embed_mirrors (guild_id, category, channel_id, message_id)
+                VALUES (?, ?, ?, ?)
+            ''', (guild_id, category, channel_id, message_id))
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error("Error adding embed mirror: %s", e)
+            return False
+
+    def get_embed_mirrors(self, guild_id: str, category: str) -> List[Tuple]:
+        """Return (channel_id, message_id) for every mirror of a guild's category embed"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT channel_id, message_id FROM embed_mirrors
+                WHERE guild_id = ? AND category = ?
+            ''', (guild_id, category))
+            
+            results = cursor.fetchall()
+            conn.close()
+            return results
+        except Exception as e:
+            logger.error("Error getting embed mirrors: %s", e)
+            return []
+
+    def remove_embed_mirrors(self, guild_id: str, category: str = None, channel_id: str = None,
+                             message_id: str = None) -> int:
+        """Delete a guild's mirrors, narrowed by category, channel and/or message. Returns count deleted."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            clauses = ['guild_id = ?']
+            params = [guild_id]
+            for column, value in (('category', category), ('channel_id', channel_id), ('message_id', message_id)):
+                if value is not None:
+                    clauses.append(f'{column} = ?')
+                    params.append(value)
+            cursor.execute(f"DELETE FROM embed_mirrors WHERE {' AND '.join(clauses)}", params)
+            
+            deleted = cursor.rowcount
+            conn.commit()
+            conn.close()
+            return deleted
+        except Exception as e:
+            logger.error("Error removing embed mirrors: %s", e)
+            return 0
+
+    def adopt_legacy_rows(self, guild_id: str) -> int:
+        """Assign queue rows from before multi-guild support (guild_id '') to a guild"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute("UPDATE queue SET guild_id = ? WHERE guild_id = ''", (guild_id,))
+            adopted = cursor.rowcount
+            cursor.execute("UPDATE queue_events SET guild_id = ? WHERE guild_id = ''", (guild_id,))
+            
+            conn.commit()
+            conn.close()
+            self._invalidate()
+            return adopted
+        except Exception as e:
+            logger.error("Error adopting legacy rows: %s", e)
+            return 0
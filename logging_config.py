@@ -0,0 +1,95 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_FORMAT = '[{asctime}] [{levelname:<8}] {name}: {message}'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_listener = None
+
+
+def _parse_levels(spec: str) -> dict:
+    """Parse 'discord=WARNING,database=DEBUG' into a {logger_name: level} map"""
+    levels = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, level = part.split('=', 1)
+        name, level = name.strip(), level.strip().upper()
+        if name and level:
+            levels[name] = int(level) if level.isdigit() else level
+    return levels
+
+
+def _build_file_handler(filename: str) -> logging.Handler:
+    """Create a rotating file handler; time-based when LOG_ROTATE_WHEN is set, size-based otherwise"""
+    backup_count = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    rotate_when = os.getenv('LOG_ROTATE_WHEN', '').strip()
+
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(
+            filename=filename,
+            when=rotate_when,
+            backupCount=backup_count,
+            encoding='utf-8',
+        )
+    return logging.handlers.RotatingFileHandler(
+        filename=filename,
+        maxBytes=int(os.getenv('LOG_MAX_BYTES', str(5 * 1024 * 1024))),
+        backupCount=backup_count,
+        encoding='utf-8',
+    )
+
+
+def setup_logging(filename: str = None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue so file/console I/O happens on a background thread.
+
+    Configured from the environment:
+      LOG_FILE          - log file path (default discord.log)
+      LOG_LEVEL         - root level (default INFO)
+      LOG_LEVELS        - per-module overrides, e.g. "discord=WARNING,database=DEBUG"
+      LOG_MAX_BYTES     - size-based rotation threshold (default 5 MiB)
+      LOG_ROTATE_WHEN   - time-based rotation interval (e.g. "midnight"); overrides size rotation
+      LOG_BACKUP_COUNT  - rotated files to keep (default 5)
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT, style='{')
+
+    file_handler = _build_file_handler(filename or os.getenv('LOG_FILE', 'discord.log'))
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    for name, level in _parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
@@ -4,46 +4,139 @@ import logging
 from dotenv import load_dotenv
 import os
 import asyncio
+import time
 from threading import Thread
-from database import QueueDatabase
+from database import QueueDatabase, ORDER_FAIR, ORDER_FIFO
+from logging_config import setup_logging, stop_logging
+from profiler import ProfilerBusy, profile_for
+from metrics import (MetricsServer, embed_edit_failures, embed_edits, instrument_database, monitor_loop_lag,
+                     process_rss_bytes, startup_seconds)
+from worker import JOBS, WorkerDatabase
+from categories import CATEGORY_NAME, CategoryRegistry
 
+started_at = time.perf_counter()
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 token = os.getenv('DISCORD_TOKEN')
 queue_channel_id = os.getenv('QUEUE_CHANNEL_ID')
 queue_message_id = os.getenv('QUEUE_MESSAGE_ID')
-requests_channel_id = os.getenv('REQUESTS_CHANNEL_ID')
 dev_channel_ids = set([cid.strip() for cid in os.getenv('DEV_CHANNEL_IDS', '').split(',') if cid.strip()])
 auto_delete_channels = set([cid.strip() for cid in os.getenv('AUTO_DELETE_CHANNEL_IDS', '').split(',') if cid.strip()])
-db = QueueDatabase()
+fair_share_categories = set([cat.strip().lower() for cat in os.getenv('FAIR_SHARE_CATEGORIES', '').split(',') if cat.strip()])
+# WORKER_MODE=process hands the database to a separate worker process (see worker.py)
+if os.getenv('WORKER_MODE', 'off').lower() in ['process', 'on', 'true', '1']:
+    db = WorkerDatabase(os.getenv('QUEUE_DB_PATH', 'queue.db'), fair_share_categories)
+else:
+    db = QueueDatabase(os.getenv('QUEUE_DB_PATH', 'queue.db'), fair_share_categories)
+backup_dir = os.getenv('BACKUP_DIR', 'backups')
+backup_keep = int(os.getenv('BACKUP_KEEP', '7'))
+backup_interval_hours = float(os.getenv('BACKUP_INTERVAL_HOURS', '0'))
+backup_lock = asyncio.Lock()
+ttl_policy_spec = os.getenv('QUEUE_TTL_POLICY', '')
+ttl_sweep_minutes = float(os.getenv('QUEUE_TTL_SWEEP_MINUTES', '60'))
+ttl_batch_size = int(os.getenv('QUEUE_TTL_BATCH_SIZE', '100'))
+if ttl_batch_size < 1:
+    # A sweep stops on its first short batch; a batch size below 1 would never produce one
+    logger.warning("QUEUE_TTL_BATCH_SIZE must be at least 1, not %d; using 100", ttl_batch_size)
+    ttl_batch_size = 100
+feed_retention_days = float(os.getenv('CHANGE_FEED_RETENTION_DAYS', '7'))
+profile_dir = os.getenv('PROFILE_DIR', 'profiles')
+metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+metrics_port = int(os.getenv('METRICS_PORT', '0'))
+if metrics_port:
+    instrument_database(db)
 
 # Single embed color used across all bot messages
 EMBED_COLOR = discord.Color(0xffc100)
 
-VALID_CATEGORIES = {'show', 'movie', 'anime'}
-USAGE_MESSAGES = {
-    'setupqueue': "Usage: !setupqueue <show|movie|anime>",
-    'resetqueue': "Usage: !resetqueue <show|movie|anime>",
-    'remove': "Usage: !remove <positions> <show|movie|anime> (e.g., !remove 1,2 anime)",
-    'clearqueue': "Usage: !clearqueue <show|movie|anime>",
-    'refresh': "Usage: !refresh [show|movie|anime]",
+# Filled from the categories table by load_categories() before the bot starts
+categories = CategoryRegistry()
+USAGE_TEMPLATES = {
+    'setupqueue': "Usage: !setupqueue <{categories}>",
+    'resetqueue': "Usage: !resetqueue <{categories}>",
+    'remove': "Usage: !remove <positions> <{categories}> (e.g., !remove 1,2 {example})",
+    'clearqueue': "Usage: !clearqueue <{categories}>",
+    'refresh': "Usage: !refresh [{categories}]",
     'setcommandautodelete': "Usage: !setcommandautodelete <on|off>",
     'setdevchannel': "Usage: !setdevchannel [on|off]",
-    'setstatus': "Usage: !setstatus <position> <show|movie|anime> <note>",
-    'delstatus': "Usage: !delstatus <position> <show|movie|anime>",
-    'toggledl': "Usage: !toggledl <positions> <show|movie|anime> (e.g., !toggledl 1,3 anime)"
+    'setstatus': "Usage: !setstatus <position> <{categories}> <note>",
+    'delstatus': "Usage: !delstatus <position> <{categories}>",
+    'toggledl': "Usage: !toggledl <positions> <{categories}> (e.g., !toggledl 1,3 {example})",
+    'setordering': "Usage: !setordering <{categories}> <fifo|fair>",
+    'undo': "Usage: !undo [count] (e.g., !undo 3)",
+    'profile': "Usage: !profile <seconds> (1-300)",
+    'mirrorqueue': "Usage: !mirrorqueue <{categories}>",
+    'unmirrorqueue': "Usage: !unmirrorqueue [{categories}]",
+    'addcategory': "Usage: !addcategory <name> (letters, digits, - and _)",
+    'removecategory': "Usage: !removecategory <{categories}>"
 }
+USAGE_MESSAGES = {}
+MAX_UNDO_STEPS = 25
+# Safety-net poll of the change feed in case a wakeup is missed
+FEED_POLL_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
 
-# Store queue message references for each category
-queue_messages = {
-    'show': None,
-    'movie': None,
-    'anime': None
-}
-queue_channels = {
-    'show': None,
-    'movie': None,
-    'anime': None
-}
+# Settings keys that single-guild deployments kept in .env (only the original three categories); imported per guild on first start
+LEGACY_SETTING_KEYS = ['REQUESTS_CHANNEL_ID'] + [
+    f'QUEUE_{category.upper()}_{kind}_ID'
+    for category in ['show', 'movie', 'anime']
+    for kind in ['CHANNEL', 'MESSAGE']
+]
+
+# Per-guild state, keyed by guild_key(): cached guild_settings rows, resolved queue embeds and their mirrors
+guild_settings = {}
+queue_messages = {}
+mirror_messages = {}
+# Set while embed_refresh_loop has nothing left to draw
+feed_idle = None
+
+def guild_key(guild) -> str:
+    """Partition key for per-guild state and queries ('' outside a guild)"""
+    return str(guild.id) if guild else ''
+
+async def db_call(name: str, *args, **kwargs):
+    """Run a database call from async code without blocking the event loop on the worker's reply"""
+    if isinstance(db, WorkerDatabase):
+        return await db.call_async(name, *args, **kwargs)
+    return getattr(db, name)(*args, **kwargs)
+
+async def load_categories():
+    """Rebuild the category registry and the usage strings that list categories"""
+    categories.load(await db_call('get_categories'))
+    example = next(iter(categories), 'show')
+    for command, template in USAGE_TEMPLATES.items():
+        USAGE_MESSAGES[command] = template.format(categories=categories.choices(), example=example)
+
+async def get_guild_settings(guild_id: str) -> dict:
+    """Return a guild's settings, loading them from the database on first use"""
+    settings = guild_settings.get(guild_id)
+    if settings is None:
+        settings = await db_call('get_guild_settings', guild_id)
+        guild_settings[guild_id] = settings
+    return settings
+
+async def set_guild_setting(guild_id: str, key: str, value: str):
+    await db_call('set_guild_setting', guild_id, key, value)
+    (await get_guild_settings(guild_id))[key] = value
+
+async def clear_guild_settings(guild_id: str, prefix: str):
+    await db_call('delete_guild_settings', guild_id, prefix)
+    settings = await get_guild_settings(guild_id)
+    for key in [key for key in settings if key.startswith(prefix)]:
+        del settings[key]
+
+def queue_setting_keys(category: str):
+    """Settings keys holding a category's embed location: (channel key, message key)"""
+    return f'QUEUE_{category.upper()}_CHANNEL_ID', f'QUEUE_{category.upper()}_MESSAGE_ID'
+
+async def clear_queue_embed_settings(guild_id: str, category: str):
+    # Exact keys, not a prefix: 'QUEUE_SHOW_' would also match a 'show_extra' category
+    keys = queue_setting_keys(category)
+    await db_call('delete_guild_setting_keys', guild_id, keys)
+    settings = await get_guild_settings(guild_id)
+    for key in keys:
+        settings.pop(key, None)
 
 def update_env_value(key: str, value: str):
     """Write or replace a single key=value pair inside .env"""
@@ -60,7 +153,27 @@ def update_env_value(key: str, value: str):
                     f.write(line)
             f.write(f"{key}={value}\n")
     except Exception as e:
-        print(f"Error updating {key} in .env: {e}")
+        logger.error("Error updating %s in .env: %s", key, e)
+
+def parse_ttl_policy(spec: str) -> dict:
+    """Parse 'show=30,anime=60:archive' into {category: (max_age_days, new_status)}"""
+    statuses = {'complete': 'completed', 'archive': 'archived'}
+    policy = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        category, rule = part.split('=', 1)
+        category = category.strip().lower()
+        days, _, action = rule.partition(':')
+        action = action.strip().lower() or 'complete'
+        if category not in categories or action not in statuses:
+            logger.warning("Ignoring invalid QUEUE_TTL_POLICY entry: %s", part.strip())
+            continue
+        try:
+            policy[category] = (float(days), statuses[action])
+        except ValueError:
+            logger.warning("Ignoring invalid QUEUE_TTL_POLICY entry: %s", part.strip())
+    return policy
 
 def serialize_id_set(values: set) -> str:
     """Serialize a set of string ids into a stable, comma-separated list"""
@@ -79,99 +192,286 @@ async def acknowledge_command(ctx):
         except Exception:
             pass
 
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name, '').strip().lower()
+    return value in ['on', 'true', '1'] if value else default
+
+# RUNTIME_PROFILE=lean skips the member list download and keeps the client caches small.
+# Commands only need message.author, so nothing here depends on the member cache.
+lean_runtime = os.getenv('RUNTIME_PROFILE', 'default').lower() == 'lean'
 intents = discord.Intents.default()
 intents.message_content = True
-intents.members = True
+intents.members = env_flag('MEMBERS_INTENT', not lean_runtime)
+
+bot_options = {
+    'chunk_guilds_at_startup': env_flag('CHUNK_GUILDS', intents.members),
+    # 0 disables the message cache; the bot never looks messages up from it
+    'max_messages': int(os.getenv('MAX_MESSAGES', '0' if lean_runtime else '1000')) or None,
+}
+if os.getenv('MEMBER_CACHE', 'none' if lean_runtime else 'default').lower() == 'none':
+    bot_options['member_cache_flags'] = discord.MemberCacheFlags.none()
+
+# AUTO_SHARD=on runs the gateway as an AutoShardedBot; SHARD_COUNT pins the shard count
+if os.getenv('SHARD_COUNT'):
+    bot_options['shard_count'] = int(os.getenv('SHARD_COUNT'))
+bot_class = commands.AutoShardedBot if os.getenv('AUTO_SHARD', 'off').lower() in ['on', 'true', '1'] else commands.Bot
 
 # Disable default help so we can register our custom help command
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+bot = bot_class(command_prefix='!', intents=intents, help_command=None, **bot_options)
+ready_seconds = None
+
+def is_admin(author) -> bool:
+    """Administrator check on the message's author object; needs no member cache or members intent"""
+    permissions = getattr(author, 'guild_permissions', None)
+    return bool(permissions and permissions.administrator)
+
+def admin_only():
+    """Command check for guild administrators, resolved from ctx.author"""
+    def predicate(ctx):
+        if is_admin(ctx.author):
+            return True
+        raise commands.MissingPermissions(['administrator'])
+    return commands.check(predicate)
+
+async def import_legacy_settings():
+    """Move single-guild .env settings and unscoped queue rows into the guild that owns them"""
+    anchor = None
+    for key in LEGACY_SETTING_KEYS:
+        if key.endswith('_CHANNEL_ID') and os.getenv(key):
+            anchor = bot.get_channel(int(os.getenv(key)))
+            if anchor:
+                break
+    if not anchor or not getattr(anchor, 'guild', None):
+        return
+    
+    guild_id = guild_key(anchor.guild)
+    if (await get_guild_settings(guild_id)).get('LEGACY_IMPORTED'):
+        return
+    for key in LEGACY_SETTING_KEYS:
+        if os.getenv(key):
+            await set_guild_setting(guild_id, key, os.getenv(key))
+    await set_guild_setting(guild_id, 'LEGACY_IMPORTED', '1')
+    adopted = await run_db_job('adopt_legacy_rows', guild_id)
+    logger.info("Imported legacy settings and %d queue item(s) into guild %s", adopted, guild_id)
 
 @bot.event
 async def on_ready():
-    global queue_messages, queue_channels
-    print(f'Logged in as {bot.user.name}... Press ENTER to exit.')
-    
-    for category in ['show', 'movie', 'anime']:
-        channel_id = os.getenv(f'QUEUE_{category.upper()}_CHANNEL_ID')
-        message_id = os.getenv(f'QUEUE_{category.upper()}_MESSAGE_ID')
-        
-        if channel_id and message_id:
-            queue_channels[category] = bot.get_channel(int(channel_id))
-            if queue_channels[category]:
-                try:
-                    queue_messages[category] = await queue_channels[category].fetch_message(int(message_id))
-                except:
-                    queue_messages[category] = None
+    global ready_seconds
+    logger.info("Logged in as %s in %d guild(s)... Press ENTER to exit.", bot.user.name, len(bot.guilds))
+    if ready_seconds is None:
+        # First READY only; reconnects would otherwise overwrite the startup measurement
+        ready_seconds = time.perf_counter() - started_at
+        startup_seconds.set(value=ready_seconds)
+        logger.info("Ready in %.1fs with the %s runtime profile: %.1f MiB resident, %d cached members, %d users",
+                    ready_seconds, 'lean' if lean_runtime else 'default', process_rss_bytes() / 2**20,
+                    sum(len(guild.members) for guild in bot.guilds), len(bot.users))
+    await import_legacy_settings()
+    # Re-resolve embeds after every (re)connect; channels may have come back or moved
+    queue_messages.clear()
+    mirror_messages.clear()
+
+async def get_queue_message(guild_id: str, category: str):
+    """Resolve (and cache) a guild's queue embed message for a category, or None if not set up.
+
+    Only a definite answer is cached: no embed configured, the message, or the message
+    being deleted. An uncached channel or a failed fetch is retried on the next render.
+    """
+    messages = queue_messages.setdefault(guild_id, {})
+    if category in messages:
+        return messages[category]
+    
+    settings = await get_guild_settings(guild_id)
+    channel_key, message_key = queue_setting_keys(category)
+    channel_id = settings.get(channel_key)
+    message_id = settings.get(message_key)
+    if not (channel_id and message_id):
+        messages[category] = None
+        return None
+    channel = bot.get_channel(int(channel_id))
+    if not channel:
+        # Not cached yet (before READY) or the guild is unavailable
+        return None
+    try:
+        message = await channel.fetch_message(int(message_id))
+    except discord.NotFound:
+        logger.warning("%s queue message %s in guild %s was deleted", category.capitalize(), message_id, guild_id)
+        message = None
+    except Exception as e:
+        logger.warning("Could not fetch %s queue message %s: %s", category, message_id, e)
+        return None
+    messages[category] = message
+    return message
+
+async def refresh_from_feed(feed, retry=()) -> set:
+    """Drain the change feed and redraw each touched (guild, category) embed once; returns the scopes that failed"""
+    scopes = set(retry)
+    # poll() is a blocking query (or worker round trip), so it runs on a thread
+    events = await asyncio.to_thread(feed.poll)
+    while events:
+        scopes.update((event[5], event[3]) for event in events)
+        events = await asyncio.to_thread(feed.poll)
+    failed = set()
+    for guild_id, category in sorted(scopes):
+        if category in categories:
+            try:
+                await update_queue_embed(guild_id, category)
+            except Exception as e:
+                # e.g. the database worker is restarting; the scope is retried on the next pass
+                logger.warning("Could not redraw the %s queue in guild %s: %s", category, guild_id, e)
+                failed.add((guild_id, category))
+    return failed
+
+async def embed_refresh_loop():
+    """Keep queue embeds in step with the change feed; a burst of mutations costs one redraw per scope"""
+    global feed_idle
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    feed_idle = asyncio.Event()
+    # on_change fires after every committed mutation, possibly from a worker thread
+    from_seq = await db_call('latest_event_seq')
+    feed = db.subscribe(from_seq, on_change=lambda: loop.call_soon_threadsafe(wakeup.set))
+    # Channels resolve only after READY; changes made meanwhile are drawn on the first pass
+    await bot.wait_until_ready()
+    retry = set()
+    try:
+        while True:
+            feed_idle.set()
+            try:
+                await asyncio.wait_for(wakeup.wait(), FEED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            feed_idle.clear()
+            wakeup.clear()
+            try:
+                retry = await refresh_from_feed(feed, retry)
+            except Exception as e:
+                logger.error("Refreshing embeds from the change feed failed: %s", e)
+    finally:
+        feed.close()
+
+async def get_mirror_messages(guild_id: str, category: str) -> list:
+    """Resolve (and cache) every mirror of a guild's category embed, pruning ones Discord reports as deleted.
 
-async def update_queue_embed(category: str = None):
-    """Update the persistent queue embed for a specific category"""
-    global queue_messages
+    Before READY a mirror whose channel is not cached yet, or one whose fetch fails
+    transiently, is skipped and the list is not cached, so it is retried next render.
+    """
+    mirrors = mirror_messages.setdefault(guild_id, {})
+    if category in mirrors:
+        return mirrors[category]
+    unresolved = []
+    
+    async def fetch(channel_id, message_id):
+        channel = bot.get_channel(int(channel_id))
+        if not channel and not bot.is_ready():
+            unresolved.append(message_id)
+            return None
+        try:
+            # After READY an uncached channel is deleted or its guild is unavailable; ask Discord which
+            channel = channel or await bot.fetch_channel(int(channel_id))
+            return await channel.fetch_message(int(message_id))
+        except discord.NotFound:
+            logger.info("Pruning deleted %s queue mirror %s in guild %s", category, message_id, guild_id)
+            await db_call('remove_embed_mirrors', guild_id, category, message_id=message_id)
+        except Exception as e:
+            logger.warning("Could not fetch %s queue mirror %s: %s", category, message_id, e)
+            unresolved.append(message_id)
+        return None
+    
+    rows = await db_call('get_embed_mirrors', guild_id, category)
+    fetched = await asyncio.gather(*(fetch(channel_id, message_id) for channel_id, message_id in rows))
+    resolved = [message for message in fetched if message]
+    if not unresolved:
+        mirrors[category] = resolved
+    return resolved
+
+def build_queue_embed(category: str, items: list) -> discord.Embed:
+    """Render a category's queue embed from its ordered items"""
+    embed = discord.Embed(title=f"📺 {category.capitalize()} Queue", color=EMBED_COLOR)
     
-    if category:
-        categories = [category.lower()]
+    if not items:
+        embed.description = "The queue is empty!"
     else:
-        categories = ['show', 'movie', 'anime']
-    
-    for cat in categories:
-        if not queue_channels.get(cat):
-            continue
+        downloading = [item for item in items if item[-1] == 1]
+        pending = [item for item in items if item[-1] == 0]
         
-        items = db.get_queue(cat)
+        lines = []
+        counter = 1
         
-        embed = discord.Embed(title=f"📺 {cat.capitalize()} Queue", color=EMBED_COLOR)
+        if downloading:
+            lines.append("__**Downloading...**__")
+            for item in downloading:
+                title = item[1]
+                note = item[6] if item[6] else ""
+                suffix = f" - _{note}_" if note else ""
+                lines.append(f"#{counter} - **{title}**{suffix}")
+                counter += 1
         
-        if not items:
-            embed.description = "The queue is empty!"
-        else:
-            downloading = [item for item in items if item[-1] == 1]
-            pending = [item for item in items if item[-1] == 0]
-            
-            lines = []
-            counter = 1
-            
-            if downloading:
-                lines.append("__**Downloading...**__")
-                for item in downloading:
-                    title = item[1]
-                    note = item[6] if item[6] else ""
-                    suffix = f" - _{note}_" if note else ""
-                    lines.append(f"#{counter} - **{title}**{suffix}")
-                    counter += 1
-            
-            if pending:
-                lines.append("__**Pending...**__")
-                for item in pending:
-                    title = item[1]
-                    note = item[6] if item[6] else ""
-                    suffix = f" - _{note}_" if note else ""
-                    lines.append(f"#{counter} - **{title}**{suffix}")
-                    counter += 1
-            
-            items_text = '\n'.join(lines)
-            embed.description = items_text
+        if pending:
+            lines.append("__**Pending...**__")
+            for item in pending:
+                title = item[1]
+                note = item[6] if item[6] else ""
+                suffix = f" - _{note}_" if note else ""
+                lines.append(f"#{counter} - **{title}**{suffix}")
+                counter += 1
         
-        pending_count = len([item for item in items if item[-1] == 0])
-        downloading_count = len([item for item in items if item[-1] == 1])
-        if downloading_count > 0:
-            footer_text = f"{pending_count} pending · {downloading_count} downloading"
+        items_text = '\n'.join(lines)
+        embed.description = items_text
+    
+    pending_count = len([item for item in items if item[-1] == 0])
+    downloading_count = len([item for item in items if item[-1] == 1])
+    if downloading_count > 0:
+        footer_text = f"{pending_count} pending · {downloading_count} downloading"
+    else:
+        footer_text = f"{pending_count} pending"
+    embed.set_footer(text=footer_text)
+    return embed
+
+async def edit_queue_target(guild_id: str, category: str, message, embed: discord.Embed, mirror: bool):
+    """Edit one copy of a queue embed; a deleted message is pruned instead of retried forever"""
+    embed_edits.inc(category)
+    try:
+        await message.edit(embed=embed)
+    except discord.NotFound:
+        embed_edit_failures.inc(category)
+        if mirror:
+            logger.info("Pruning deleted %s queue mirror %s in guild %s", category, message.id, guild_id)
+            await db_call('remove_embed_mirrors', guild_id, category, message_id=str(message.id))
+            mirrors = mirror_messages.get(guild_id, {}).get(category, [])
+            if message in mirrors:
+                mirrors.remove(message)
         else:
-            footer_text = f"{pending_count} pending"
-        embed.set_footer(text=footer_text)
+            logger.warning("%s queue embed in guild %s was deleted; run !setupqueue %s again",
+                           category.capitalize(), guild_id, category)
+            await clear_queue_embed_settings(guild_id, category)
+            queue_messages.setdefault(guild_id, {})[category] = None
+    except Exception as e:
+        embed_edit_failures.inc(category)
+        logger.warning("Failed to edit %s queue embed %s in guild %s: %s", category, message.id, guild_id, e)
+
+async def update_queue_embed(guild_id: str, category: str = None):
+    """Update a guild's persistent queue embed, and any mirrors of it, for a specific category"""
+    for cat in [category.lower()] if category else categories:
+        queue_message, mirrors = await asyncio.gather(get_queue_message(guild_id, cat),
+                                                      get_mirror_messages(guild_id, cat))
+        targets = [(message, True) for message in mirrors]
+        if queue_message:
+            targets.insert(0, (queue_message, False))
+        if not targets:
+            continue
         
-        try:
-            if queue_messages[cat]:
-                await queue_messages[cat].edit(embed=embed)
-        except:
-            pass
+        # Render once and edit every copy concurrently; one failing target never blocks the rest
+        embed = build_queue_embed(cat, await db_call('get_queue', cat, guild_id))
+        await asyncio.gather(*(edit_queue_target(guild_id, cat, message, embed, mirror)
+                               for message, mirror in targets))
 
-def get_category_items(category: str):
-    """Return ordered active items (downloading first) for a category"""
-    return db.get_queue(category)
+async def get_category_items(guild_id: str, category: str):
+    """Return ordered active items (downloading first) for a guild's category"""
+    return await db_call('get_queue', category, guild_id)
 
-def get_item_by_position(category: str, position: int):
+async def get_item_by_position(guild_id: str, category: str, position: int):
     """Get queue item tuple by visible position number"""
-    items = get_category_items(category)
+    items = await get_category_items(guild_id, category)
     if position < 1 or position > len(items):
         return None, items
     return items[position - 1], items
@@ -181,6 +481,9 @@ async def on_message(message):
     if message.author == bot.user:
         return
     
+    guild_id = guild_key(message.guild)
+    requests_channel_id = (await get_guild_settings(guild_id)).get('REQUESTS_CHANNEL_ID')
+    
     # Only process requests in the designated channel (if set)
     allowed_channels = set(dev_channel_ids)
     if requests_channel_id:
@@ -190,32 +493,14 @@ async def on_message(message):
         await bot.process_commands(message)
         return
     
-    content = message.content.lower()
-
-    if '(show)' in content:
-        text_before = message.content[:message.content.lower().index('(show)')].strip()
-        item_id = db.add_to_queue(text_before, 'show', str(message.author.id), message.author.name)
+    category, title = categories.classify(message.content)
+    # Requests belong to a guild; a DM would land in the unowned '' partition nobody sees
+    if category and message.guild is not None:
+        item_id = await db_call('add_to_queue', title, category, str(message.author.id), message.author.name, guild_id)
         try:
             await message.add_reaction("✅")
         except Exception:
             pass
-        await update_queue_embed('show')
-    elif '(movie)' in content:
-        text_before = message.content[:message.content.lower().index('(movie)')].strip()
-        item_id = db.add_to_queue(text_before, 'movie', str(message.author.id), message.author.name)
-        try:
-            await message.add_reaction("✅")
-        except Exception:
-            pass
-        await update_queue_embed('movie')
-    elif '(anime)' in content:
-        text_before = message.content[:message.content.lower().index('(anime)')].strip()
-        item_id = db.add_to_queue(text_before, 'anime', str(message.author.id), message.author.name)
-        try:
-            await message.add_reaction("✅")
-        except Exception:
-            pass
-        await update_queue_embed('anime')
     await bot.process_commands(message)
 
 @bot.event
@@ -245,16 +530,18 @@ async def on_command_completion(ctx):
             pass
 
 @bot.command()
-async def undo(ctx):
-    """Undo your last queue entry"""
-    result = db.undo_last_entry(str(ctx.author.id))
+async def undo(ctx, count: int = 1):
+    """Undo your last queue actions (adds, removes and toggles)"""
+    if count < 1 or count > MAX_UNDO_STEPS:
+        await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['undo']}")
+        return
     
-    if result:
-        item_id, title, category = result
+    reverted = await db_call('undo_actions', str(ctx.author.id), count)
+    
+    if reverted:
         await acknowledge_command(ctx)
-        await update_queue_embed(category)
     else:
-        await ctx.send(f"ƒ?O Nothing to undo! You haven't added anything to the queue yet.")
+        await ctx.send("❌ Nothing left to undo. Your recent actions were already undone or their items have moved on.")
 
 @bot.command()
 async def help(ctx):
@@ -263,33 +550,34 @@ async def help(ctx):
     
     embed.add_field(
         name="__**Add Requests**__",
-        value="**Text (show)** - Add a show to the queue\n*Example: Breaking Bad (show)*\n\n**Text (movie)** - Add a movie to the queue\n*Example: The Matrix (movie)*\n\n**Text (anime)** - Add an anime to the queue\n*Example: Death Note (anime)*",
+        value='\n'.join(f"**Text ({name})** - Add a {name} to the queue" for name in categories)
+              + f"\n*Example: Breaking Bad ({next(iter(categories), 'show')})*",
         inline=False
     )
     
     embed.add_field(
         name="__**Manage Your Requests**__",
-        value="**!undo** - Remove your last added request\n*Example: !undo*\n\n**!remove <positions> <category>** - Mark one or more items as completed\n*Example: !remove 1,2,3 anime*\n\n**Admins: !toggledl <positions> <category>** - Toggle downloading status for multiple items",
+        value="**!undo [count]** - Undo your last adds, removes or toggles\n*Example: !undo 2*\n\n**!remove <positions> <category>** - Mark one or more items as completed\n*Example: !remove 1,2,3 anime*\n\n**Admins: !toggledl <positions> <category>** - Toggle downloading status for multiple items",
         inline=False
     )
     
     await ctx.send(embed=embed)
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def helpadmin(ctx):
     """Display available admin commands"""
     embed = discord.Embed(title="🔧 Admin Commands", color=EMBED_COLOR)
     
     embed.add_field(
         name="__**Setup & Channels**__",
-        value="**!setupqueue <category>** - Create a queue embed in this channel\n**!setrequestschannel** - Set channel for user submissions\n**!setdevchannel [on|off]** - Allow/deny this channel as an extra requests channel\n**!setcommandautodelete [on|off]** - Auto-delete successful commands here",
+        value="**!setupqueue <category>** - Create a queue embed in this channel\n**!mirrorqueue <category>** - Show a live copy of a queue embed in this channel\n**!unmirrorqueue [category]** - Remove queue copies from this channel\n**!setrequestschannel** - Set channel for user submissions\n**!setdevchannel [on|off]** - Allow/deny this channel as an extra requests channel\n**!setcommandautodelete [on|off]** - Auto-delete successful commands here",
         inline=False
     )
     
     embed.add_field(
         name="__**Queue Control**__",
-        value="**!resetqueue <category>** - Reset a queue embed\n**!clearqueue <category>** - Clear all pending items\n**!resetallqueues** - Reset all queue embeds\n**!refresh [category]** - Manually refresh embeds",
+        value="**!resetqueue <category>** - Reset a queue embed\n**!clearqueue <category>** - Clear all pending items\n**!resetallqueues** - Reset all queue embeds\n**!refresh [category]** - Manually refresh embeds\n**!setordering <category> <fifo|fair>** - Order by request time or round-robin by user\n**!addcategory <name>** / **!removecategory <name>** - Manage categories (bot owner)\n**!backup** - Write a database snapshot\n**!profile <seconds>** - Profile the bot and post the hottest functions",
         inline=False
     )
 
@@ -314,7 +602,7 @@ async def remove(ctx, *, args: str):
         return
     
     category = parts[-1].lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['remove']}")
         return
     
@@ -325,7 +613,7 @@ async def remove(ctx, *, args: str):
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['remove']}")
         return
     
-    items = db.get_queue(category)
+    items = await db_call('get_queue', category, guild_key(ctx.guild))
     if not items:
         await ctx.send(f"❌ The {category} queue is empty.")
         return
@@ -336,13 +624,12 @@ async def remove(ctx, *, args: str):
         await ctx.send(f"❌ Positions not found in the {category} queue: {', '.join(map(str, invalid_positions))}")
         return
     
-    is_admin = ctx.author.guild_permissions.administrator
     user_id = str(ctx.author.id)
     
     # Map positions to items (1-based)
     selected_items = [(p, items[p - 1]) for p in positions]
     
-    if not is_admin:
+    if not is_admin(ctx.author):
         unauthorized = [p for p, item in selected_items if item[3] != user_id]
         if unauthorized:
             await ctx.send("❌ You can't remove a request that isn't yours.")
@@ -352,21 +639,20 @@ async def remove(ctx, *, args: str):
     failed_positions = []
     for pos, item in selected_items:
         item_id, title = item[0], item[1]
-        if db.remove_from_queue(item_id):
+        if await db_call('remove_from_queue', item_id, user_id):
             removed_titles.append((pos, title))
         else:
             failed_positions.append(pos)
     
     if removed_titles:
         await acknowledge_command(ctx)
-        await update_queue_embed(category)
 
     
     if failed_positions:
         await ctx.send(f"❌ Could not remove positions: {', '.join(map(str, failed_positions))}")
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def setstatus(ctx, position: int = None, category: str = None, *, note: str = None):
     """Add or overwrite a status note on a queue entry"""
     if position is None or category is None or note is None:
@@ -374,25 +660,24 @@ async def setstatus(ctx, position: int = None, category: str = None, *, note: st
         return
     
     category = category.lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['setstatus']}")
         return
     
-    item, items = get_item_by_position(category, position)
+    item, items = await get_item_by_position(guild_key(ctx.guild), category, position)
     if not item:
         await ctx.send(f"❌ Position not found. {USAGE_MESSAGES['setstatus']}")
         return
     
-    updated = db.set_status_note(item[0], note)
+    updated = await db_call('set_status_note', item[0], note)
     if not updated:
         await ctx.send("❌ Could not update status for that entry.")
         return
     
     await acknowledge_command(ctx)
-    await update_queue_embed(category)
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def delstatus(ctx, position: int = None, category: str = None):
     """Remove a status note from a queue entry"""
     if position is None or category is None:
@@ -400,25 +685,24 @@ async def delstatus(ctx, position: int = None, category: str = None):
         return
     
     category = category.lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['delstatus']}")
         return
     
-    item, items = get_item_by_position(category, position)
+    item, items = await get_item_by_position(guild_key(ctx.guild), category, position)
     if not item:
         await ctx.send(f"❌ Position not found. {USAGE_MESSAGES['delstatus']}")
         return
     
-    cleared = db.clear_status_note(item[0])
+    cleared = await db_call('clear_status_note', item[0])
     if not cleared:
         await ctx.send("❌ Could not clear status for that entry.")
         return
     
     await acknowledge_command(ctx)
-    await update_queue_embed(category)
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def toggledl(ctx, *, args: str = None):
     """Toggle one or more queue entries between downloading and pending"""
     if not args:
@@ -431,7 +715,7 @@ async def toggledl(ctx, *, args: str = None):
         return
     
     category = parts[-1].lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"??? Incorrect usage. {USAGE_MESSAGES['toggledl']}")
         return
     
@@ -442,7 +726,7 @@ async def toggledl(ctx, *, args: str = None):
         await ctx.send(f"??? Incorrect usage. {USAGE_MESSAGES['toggledl']}")
         return
     
-    items = db.get_queue(category)
+    items = await db_call('get_queue', category, guild_key(ctx.guild))
     if not items:
         await ctx.send(f"??? The {category} queue is empty.")
         return
@@ -457,7 +741,7 @@ async def toggledl(ctx, *, args: str = None):
     failed_positions = []
     for pos in positions:
         item = items[pos - 1]
-        success = db.toggle_downloading(item[0])
+        success = await db_call('toggle_downloading', item[0], str(ctx.author.id))
         if success:
             toggled_positions.append(pos)
         else:
@@ -465,130 +749,180 @@ async def toggledl(ctx, *, args: str = None):
     
     if toggled_positions:
         await acknowledge_command(ctx)
-        await update_queue_embed(category)
     
     if failed_positions:
         await ctx.send(f"??? Could not toggle positions: {', '.join(map(str, failed_positions))}")
 
 @bot.command()
-@commands.has_permissions(administrator=True)
-async def setupqueue(ctx, category: str):
-    """Setup the persistent queue embed for a category (show/movie/anime) (owner only)"""
-    global queue_messages, queue_channels
+@commands.is_owner()
+async def addcategory(ctx, name: str = None):
+    """Register a new queue category for every guild (bot owner only)"""
+    name = (name or '').lower()
+    if not CATEGORY_NAME.match(name):
+        await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['addcategory']}")
+        return
+    if name in categories:
+        await ctx.send(f"ℹ️ The {name} category already exists.")
+        return
     
+    if not await db_call('add_category', name):
+        await ctx.send("❌ Could not add the category. Check the bot logs.")
+        return
+    await load_categories()
+    await ctx.send(f"✅ Added the {name} category. Tag requests with `({name})` and run `!setupqueue {name}` to show its queue.")
+
+@bot.command()
+@commands.is_owner()
+async def removecategory(ctx, name: str = None):
+    """Stop accepting requests for a category; its items are kept if it is added back (bot owner only)"""
+    name = (name or '').lower()
+    if name not in categories:
+        await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['removecategory']}")
+        return
+    
+    if not await db_call('remove_category', name):
+        await ctx.send("❌ Could not remove the category. Check the bot logs.")
+        return
+    await load_categories()
+    await ctx.send(f"✅ Removed the {name} category. Its queue items are kept in case you add it back.")
+
+@bot.command()
+@admin_only()
+async def setupqueue(ctx, category: str):
+    """Setup the persistent queue embed for a category (owner only)"""
     category = category.lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['setupqueue']}")
         return
     
-    queue_channels[category] = ctx.channel
+    guild_id = guild_key(ctx.guild)
     
     embed = discord.Embed(title=f"📺 {category.capitalize()} Queue", color=EMBED_COLOR)
     embed.description = "The queue is empty!"
     embed.set_footer(text="Total: 0 pending")
     
-    queue_messages[category] = await ctx.send(embed=embed)
+    message = await ctx.send(embed=embed)
+    queue_messages.setdefault(guild_id, {})[category] = message
     
-    # Save the message ID to .env
-    with open('.env', 'a') as f:
-        f.write(f'\nQUEUE_{category.upper()}_CHANNEL_ID={ctx.channel.id}\n')
-        f.write(f'QUEUE_{category.upper()}_MESSAGE_ID={queue_messages[category].id}\n')
+    # Save the embed location in this guild's settings
+    channel_key, message_key = queue_setting_keys(category)
+    await set_guild_setting(guild_id, channel_key, str(ctx.channel.id))
+    await set_guild_setting(guild_id, message_key, str(message.id))
+    
+@bot.command()
+@admin_only()
+async def mirrorqueue(ctx, category: str = None):
+    """Post a live copy of a category's queue embed in this channel (admin only)"""
+    category = (category or '').lower()
+    if category not in categories:
+        await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['mirrorqueue']}")
+        return
+    
+    guild_id = guild_key(ctx.guild)
+    mirrors = await get_mirror_messages(guild_id, category)
+    message = await ctx.send(embed=build_queue_embed(category, await db_call('get_queue', category, guild_id)))
+    if not await db_call('add_embed_mirror', guild_id, category, str(ctx.channel.id), str(message.id)):
+        await ctx.send("❌ Could not save the mirror. Check the bot logs.")
+        return
+    mirrors.append(message)
+    await acknowledge_command(ctx)
+
+@bot.command()
+@admin_only()
+async def unmirrorqueue(ctx, category: str = None):
+    """Remove queue embed copies from this channel, for one or all categories (admin only)"""
+    if category:
+        category = category.lower()
+        if category not in categories:
+            await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['unmirrorqueue']}")
+            return
     
+    guild_id = guild_key(ctx.guild)
+    for cat in [category] if category else categories:
+        # Resolve from the database first so copies not yet fetched since startup are deleted too
+        mirrors = await get_mirror_messages(guild_id, cat)
+        for message in [message for message in mirrors if message.channel.id == ctx.channel.id]:
+            mirrors.remove(message)
+            try:
+                await message.delete()
+            except Exception:
+                pass
+    removed = await db_call('remove_embed_mirrors', guild_id, category, channel_id=str(ctx.channel.id))
+    
+    if removed == 0:
+        await ctx.send("ℹ️ There are no queue mirrors in this channel.")
+    else:
+        await ctx.send(f"✅ Removed {removed} queue mirror(s) from {ctx.channel.mention}.")
+
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def setrequestschannel(ctx):
     """Set the channel where queue requests are accepted (owner only)"""
-    global requests_channel_id
-    requests_channel_id = str(ctx.channel.id)
-    
-    update_env_value('REQUESTS_CHANNEL_ID', requests_channel_id)
+    await set_guild_setting(guild_key(ctx.guild), 'REQUESTS_CHANNEL_ID', str(ctx.channel.id))
     
     await ctx.send(f"✅ Requests channel set to {ctx.channel.mention}.\nOnly messages in this channel will be processed for queue requests.")
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def resetqueue(ctx, category: str):
     """Reset a queue embed for a specific category (owner only)"""
-    global queue_messages, queue_channels
-    
     category = category.lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['resetqueue']}")
         return
     
-    queue_messages[category] = None
-    queue_channels[category] = None
-    
-    # Remove from .env
-    try:
-        with open('.env', 'r') as f:
-            lines = f.readlines()
-        
-        with open('.env', 'w') as f:
-            for line in lines:
-                if not line.startswith(f'QUEUE_{category.upper()}_'):
-                    f.write(line)
-    except:
-        pass
+    guild_id = guild_key(ctx.guild)
+    queue_messages.setdefault(guild_id, {})[category] = None
+    mirror_messages.setdefault(guild_id, {})[category] = []
+    await clear_queue_embed_settings(guild_id, category)
+    await db_call('remove_embed_mirrors', guild_id, category)
     
     await ctx.send(f"✅ {category.capitalize()} queue embed reset! Run `!setupqueue {category}` in the new channel.")
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def clearqueue(ctx, category: str):
     """Clear all pending items in a category queue (owner only)"""
     category = category.lower()
-    if category not in VALID_CATEGORIES:
+    if category not in categories:
         await ctx.send(f"❌ Incorrect usage. {USAGE_MESSAGES['clearqueue']}")
         return
     
-    cleared = db.clear_queue(category)
+    cleared = await db_call('clear_queue', category, guild_key(ctx.guild))
     if cleared == 0:
         await ctx.send(f"ℹ️ The {category} queue is already empty.")
     else:
         await ctx.send(f"✅ Cleared {cleared} item(s) from the {category} queue.")
-    await update_queue_embed(category)
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def resetallqueues(ctx):
     """Reset all queue embeds (owner only)"""
-    global queue_messages, queue_channels
-    
-    for category in ['show', 'movie', 'anime']:
-        queue_messages[category] = None
-        queue_channels[category] = None
-    
-    # Remove all queue settings from .env
-    try:
-        with open('.env', 'r') as f:
-            lines = f.readlines()
-        
-        with open('.env', 'w') as f:
-            for line in lines:
-                if not line.startswith('QUEUE_'):
-                    f.write(line)
-    except:
-        pass
-    
-    await ctx.send("✅ All queue embeds reset! Run `!setupqueue show`, `!setupqueue movie`, and `!setupqueue anime` in your desired channels.")
+    guild_id = guild_key(ctx.guild)
+    queue_messages[guild_id] = dict.fromkeys(categories)
+    mirror_messages[guild_id] = {category: [] for category in categories}
+    await clear_guild_settings(guild_id, 'QUEUE_')
+    await db_call('remove_embed_mirrors', guild_id)
+    
+    commands_text = ', '.join(f"`!setupqueue {category}`" for category in categories)
+    await ctx.send(f"✅ All queue embeds reset! Run {commands_text} in your desired channels.")
 
 
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def refresh(ctx, category: str = None):
     """Manually refresh queue embeds for all or one category (admin only)"""
     if category:
         category = category.lower()
-        if category not in VALID_CATEGORIES:
+        if category not in categories:
             await ctx.send(f"\u274c Incorrect usage. {USAGE_MESSAGES['refresh']}")
             return
-    await update_queue_embed(category)
+    await update_queue_embed(guild_key(ctx.guild), category)
     await acknowledge_command(ctx)
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def setdevchannel(ctx, state: str = "on"):
     """Allow or block this channel as an additional requests channel (admin only)"""
     global dev_channel_ids
@@ -618,7 +952,7 @@ async def setdevchannel(ctx, state: str = "on"):
     await ctx.send(f"\u2705 {ctx.channel.mention} can now accept queue requests alongside the main requests channel.")
 
 @bot.command()
-@commands.has_permissions(administrator=True)
+@admin_only()
 async def setcommandautodelete(ctx, state: str = "on"):
     """Toggle auto-deleting successful commands in this channel (admin only)"""
     global auto_delete_channels
@@ -653,15 +987,159 @@ async def setcommandautodelete(ctx, state: str = "on"):
     update_env_value('AUTO_DELETE_CHANNEL_IDS', serialize_id_set(auto_delete_channels))
     await ctx.send(f"\u2705 Successful commands in {ctx.channel.mention} will now be deleted.")
 
+@bot.command()
+@admin_only()
+async def setordering(ctx, category: str = None, mode: str = None):
+    """Switch a category between FIFO and fair-share (round-robin by user) ordering (admin only)"""
+    if category is None or mode is None:
+        await ctx.send(f"\u274c Incorrect usage. {USAGE_MESSAGES['setordering']}")
+        return
+    
+    category = category.lower()
+    mode = mode.lower()
+    if category not in categories or mode not in [ORDER_FIFO, ORDER_FAIR]:
+        await ctx.send(f"\u274c Incorrect usage. {USAGE_MESSAGES['setordering']}")
+        return
+    
+    await db_call('set_ordering', category, mode, guild_key(ctx.guild))
+    await acknowledge_command(ctx)
+    await update_queue_embed(guild_key(ctx.guild), category)
+
+async def run_db_job(name: str, *args):
+    """Run a long database job off the event loop: in the worker process when split, on a thread otherwise"""
+    if isinstance(db, WorkerDatabase):
+        return await db.call_async(name, *args)
+    handler = JOBS.get(name) or getattr(db, name)
+    return await asyncio.to_thread(handler, *args)
+
+async def run_backup() -> str:
+    """Snapshot the database off the event loop; only one backup runs at a time"""
+    async with backup_lock:
+        return await run_db_job('create_snapshot', db.db_path, backup_dir, backup_keep)
+
+async def backup_loop():
+    """Take a rotated snapshot every BACKUP_INTERVAL_HOURS"""
+    while True:
+        await asyncio.sleep(backup_interval_hours * 3600)
+        try:
+            await run_backup()
+        except Exception as e:
+            logger.error("Scheduled backup failed: %s", e)
+
+@bot.command()
+@admin_only()
+async def backup(ctx):
+    """Write a snapshot of the queue database (admin only)"""
+    try:
+        path = await run_backup()
+    except Exception as e:
+        logger.error("Manual backup failed: %s", e)
+        await ctx.send("\u274c Backup failed. Check the bot log for details.")
+        return
+    size_kb = os.path.getsize(path) / 1024
+    await ctx.send(f"\u2705 Backup written to `{os.path.basename(path)}` ({size_kb:.1f} KB).")
+
+@bot.command()
+@admin_only()
+async def profile(ctx, seconds: int = None):
+    """Profile the bot for a few seconds and post the top hot spots (admin only)"""
+    if seconds is None or seconds < 1 or seconds > MAX_PROFILE_SECONDS:
+        await ctx.send(f"\u274c Incorrect usage. {USAGE_MESSAGES['profile']}")
+        return
+    
+    await acknowledge_command(ctx)
+    try:
+        path, summary = await profile_for(seconds, profile_dir)
+    except ProfilerBusy:
+        await ctx.send("\u274c A profile is already running.")
+        return
+    
+    logger.info("Profile written to %s\n%s", path, summary)
+    # Keep the reply inside Discord's 2000 character limit
+    if len(summary) > 1900:
+        summary = summary[:1900] + '\n...'
+    await ctx.send(f"\u2705 Profile saved to `{os.path.basename(path)}`\n```\n{summary}\n```")
+
+async def sweep_stale_items(policy: dict):
+    """Expire stale pending items in small batches; returns ({category: count expired}, {(guild_id, category)} touched)"""
+    expired = {}
+    affected = set()
+    for category, (max_age_days, new_status) in policy.items():
+        total = 0
+        while True:
+            count, scopes = await run_db_job('expire_stale_items', category, max_age_days, new_status, ttl_batch_size)
+            total += count
+            affected.update(scopes)
+            if count < ttl_batch_size:
+                break
+            # Let other handlers interleave between batches
+            await asyncio.sleep(0)
+        if total:
+            expired[category] = total
+    return expired, affected
+
+async def ttl_sweep_loop(policy: dict):
+    """Periodically enforce QUEUE_TTL_POLICY; embed_refresh_loop redraws the affected embeds"""
+    await bot.wait_until_ready()
+    while True:
+        try:
+            expired, affected = await sweep_stale_items(policy)
+            for category, count in expired.items():
+                guilds = len({guild_id for guild_id, cat in affected if cat == category})
+                logger.info("Expired %d stale %s item(s) in %d guild(s)", count, category, guilds)
+        except Exception as e:
+            logger.error("TTL sweep failed: %s", e)
+        await asyncio.sleep(ttl_sweep_minutes * 60)
+
+async def change_feed_retention_loop():
+    """Trim change-feed events older than CHANGE_FEED_RETENTION_DAYS once an hour"""
+    while True:
+        try:
+            total = 0
+            while True:
+                trimmed = await run_db_job('trim_change_feed', feed_retention_days)
+                total += trimmed
+                if trimmed == 0:
+                    break
+                await asyncio.sleep(0)
+            if total:
+                logger.info("Trimmed %d change-feed event(s) older than %g days", total, feed_retention_days)
+        except Exception as e:
+            logger.error("Change-feed retention failed: %s", e)
+        await asyncio.sleep(3600)
+
 async def listen_for_input():
     loop = asyncio.get_event_loop()
     await loop.run_in_executor(None, input)
     await bot.close()
 
 async def main():
-    async with bot:
-        asyncio.create_task(listen_for_input())
-        await bot.start(token, reconnect=True)
+    metrics_server = None
+    if isinstance(db, WorkerDatabase):
+        db.start()
+    await load_categories()
+    try:
+        async with bot:
+            asyncio.create_task(listen_for_input())
+            asyncio.create_task(embed_refresh_loop())
+            if feed_retention_days > 0:
+                asyncio.create_task(change_feed_retention_loop())
+            if metrics_port:
+                metrics_server = MetricsServer(bot, db, metrics_host, metrics_port)
+                await metrics_server.start()
+                asyncio.create_task(monitor_loop_lag())
+            if backup_interval_hours > 0:
+                asyncio.create_task(backup_loop())
+            ttl_policy = parse_ttl_policy(ttl_policy_spec)
+            if ttl_policy:
+                asyncio.create_task(ttl_sweep_loop(ttl_policy))
+            await bot.start(token, reconnect=True)
+    finally:
+        if metrics_server:
+            await metrics_server.stop()
+        if isinstance(db, WorkerDatabase):
+            db.close()
+        stop_logging()
 
 if __name__ == '__main__':
     asyncio.run(main())
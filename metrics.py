@@ -0,0 +1,270 @@
+"""Prometheus-format metrics and a health check served from the bot's event loop.
+
+Uses aiohttp (installed with discord.py), so there is no extra dependency. Enable it
+by setting METRICS_PORT; METRICS_HOST defaults to 127.0.0.1.
+
+Endpoints:
+    /metrics  - Prometheus text exposition
+    /healthz  - 200 when the database answers a trivial query, 503 otherwise
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# QueueDatabase methods that are timed individually; everything else is left unwrapped
+INSTRUMENTED_DB_METHODS = [
+    'add_to_queue', 'get_queue', 'remove_from_queue', 'clear_queue', 'expire_stale_items',
+    'get_item', 'undo_actions', 'get_user_stats', 'get_queue_stats', 'set_status_note',
+    'clear_status_note', 'toggle_downloading', 'get_events_since', 'get_guild_settings',
+    'set_guild_setting',
+]
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Gauge:
+    """A gauge whose samples come from a callback at scrape time: fn() -> {label_values: value}"""
+
+    def __init__(self, name: str, help_text: str, labels=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+
+    def set(self, *label_values, value: float):
+        self._values[label_values] = value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        values = dict(self._values)
+        if self.collect:
+            try:
+                values.update(self.collect())
+            except Exception as e:
+                logger.error("Collecting %s failed: %s", self.name, e)
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels + ('le',), label_values + (repr(bound),))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _format_labels(self.labels + ('le',), label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                plain = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{plain} {total}')
+                lines.append(f'{self.name}_count{plain} {count}')
+        return lines
+
+
+db_query_seconds = Histogram('queue_db_query_seconds', 'QueueDatabase call latency', ['method'])
+embed_edits = Counter('queue_embed_edits_total', 'Queue embed edits attempted', ['category'])
+embed_edit_failures = Counter('queue_embed_edit_failures_total', 'Queue embed edits that raised', ['category'])
+loop_lag_seconds = Histogram('queue_event_loop_lag_seconds', 'Event loop scheduling delay', [],
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+loop_lag_current = Gauge('queue_event_loop_lag_current_seconds', 'Most recent event loop scheduling delay')
+startup_seconds = Gauge('queue_startup_seconds', 'Time from process start until the first READY')
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        # ru_maxrss is in bytes on macOS, the only common platform without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def instrument_database(db):
+    """Wrap QueueDatabase methods so every call is timed into queue_db_query_seconds.
+
+    For a WorkerDatabase the timings include the round trip to the worker process.
+    """
+    for name in INSTRUMENTED_DB_METHODS:
+        method = getattr(db, name, None)
+        if method is None:
+            continue
+
+        @functools.wraps(method)
+        def timed(*args, _method=method, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                db_query_seconds.observe(_name, value=time.perf_counter() - started)
+
+        setattr(db, name, timed)
+
+    call_async = getattr(db, 'call_async', None)
+    if call_async is not None:
+        # Split mode: async callers go through WorkerDatabase.call_async, past the wrappers above
+        @functools.wraps(call_async)
+        async def timed_call(name, *args, **kwargs):
+            if name not in INSTRUMENTED_DB_METHODS:
+                return await call_async(name, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await call_async(name, *args, **kwargs)
+            finally:
+                db_query_seconds.observe(name, value=time.perf_counter() - started)
+
+        db.call_async = timed_call
+    return db
+
+
+async def monitor_loop_lag(interval: float = 1.0):
+    """Measure how late the loop wakes us compared with the requested sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag_seconds.observe(value=lag)
+        loop_lag_current.set(value=lag)
+
+
+class MetricsServer:
+    """aiohttp server exposing /metrics and /healthz on the running event loop"""
+
+    def __init__(self, bot, db, host: str = '127.0.0.1', port: int = 9108, health_timeout: float = 2.0):
+        self.bot = bot
+        self.db = db
+        self.host = host
+        self.port = port
+        self.health_timeout = health_timeout
+        self._runner = None
+        self._queue_stats = {}
+        self.metrics = [
+            Gauge('queue_pending_items', 'Pending (not downloading) items per category', ['category'],
+                  collect=lambda: self._per_category('pending')),
+            Gauge('queue_downloading_items', 'Downloading items per category', ['category'],
+                  collect=lambda: self._per_category('downloading')),
+            Gauge('queue_gateway_latency_seconds', 'Discord gateway heartbeat latency',
+                  collect=self._gateway_latency),
+            Gauge('queue_process_resident_bytes', 'Resident memory of the bot process',
+                  collect=lambda: {(): process_rss_bytes()}),
+            Gauge('queue_cached_objects', 'Objects held in the Discord client cache', ['kind'],
+                  collect=self._cache_sizes),
+            startup_seconds,
+            db_query_seconds,
+            embed_edits,
+            embed_edit_failures,
+            loop_lag_seconds,
+            loop_lag_current,
+        ]
+
+    def _per_category(self, kind: str) -> dict:
+        pending = self._queue_stats.get('by_category', {})
+        downloading = self._queue_stats.get('downloading_by_category', {})
+        if kind == 'downloading':
+            return {(category,): downloading.get(category) or 0 for category in pending}
+        return {(category,): count - (downloading.get(category) or 0) for category, count in pending.items()}
+
+    def _gateway_latency(self) -> dict:
+        latency = self.bot.latency
+        if latency != latency or latency == float('inf'):
+            return {}
+        return {(): latency}
+
+    def _cache_sizes(self) -> dict:
+        return {
+            ('members',): sum(len(guild.members) for guild in self.bot.guilds),
+            ('users',): len(self.bot.users),
+            ('messages',): len(self.bot.cached_messages),
+        }
+
+    async def handle_metrics(self, request):
+        # Stats come from a worker thread so a slow query never stalls the gateway
+        self._queue_stats = await asyncio.to_thread(self.db.get_queue_stats) or {}
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8')
+
+    async def handle_healthz(self, request):
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.db.ping), self.health_timeout)
+        except Exception as e:
+            logger.warning("Health check failed: %s", e)
+            return web.Response(status=503, text=f'database unavailable: {e}\n')
+        return web.Response(text='ok\n')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/healthz', self.handle_healthz)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Metrics server listening on http://%s:%d", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,337 @@
+"""Versioned schema migrations for the queue database, keyed on PRAGMA user_version.
+
+Each entry in MIGRATIONS upgrades the schema by one version inside its own
+transaction. Backfills that touch many rows are BatchedMigration steps: every
+batch commits on its own together with a resume key, so a large upgrade never
+holds the write lock for long and picks up where it left off after a restart.
+
+On an up-to-date database, migrate() is a single PRAGMA read.
+
+Usage:
+    python migrations.py [--db queue.db] [--status]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Seeded undo entries use seq = item id - this, well below the first logged seq of 1
+SEEDED_ACTION_OFFSET = 2 ** 62
+
+
+class Migration:
+    """A schema step applied in one transaction: apply(cursor)"""
+
+    def __init__(self, version: int, description: str, apply):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+class BatchedMigration(Migration):
+    """A backfill applied in resumable batches: apply(cursor, last_key, batch_size) -> next key or None when done"""
+
+
+def _has_column(cursor, table: str, column: str) -> bool:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return column in [row[1] for row in cursor.fetchall()]
+
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    if not _has_column(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            category TEXT NOT NULL,
+            added_by TEXT NOT NULL,
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            status_note TEXT DEFAULT '',
+            is_downloading INTEGER DEFAULT 0
+        )
+    ''')
+    # Tracks contributions per user
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            items_added INTEGER DEFAULT 0,
+            last_added TIMESTAMP
+        )
+    ''')
+    # Databases created before these columns existed
+    _add_column(cursor, 'queue', 'status_note', "TEXT DEFAULT ''")
+    _add_column(cursor, 'queue', 'is_downloading', "INTEGER DEFAULT 0")
+
+
+def _create_user_actions(cursor):
+    # Append-only per-user action log backing multi-level !undo
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_actions (
+            user_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            prev_status TEXT,
+            prev_downloading INTEGER,
+            undone INTEGER DEFAULT 0,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, seq)
+        )
+    ''')
+    # Only live (not yet undone) actions, so the newest N are an index range read
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_actions_live
+        ON user_actions (user_id, seq) WHERE undone = 0
+    ''')
+
+
+def _create_change_feed(cursor):
+    # Append-only change feed; AUTOINCREMENT keeps seq monotonic even after deletes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS queue_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _partition_by_guild(cursor):
+    # Per-guild settings (requests channel, queue embeds, ordering) as key/value rows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (guild_id, key)
+        )
+    ''')
+    # Rows from before multi-guild support keep '' until adopt_legacy_rows assigns them
+    _add_column(cursor, 'queue', 'guild_id', "TEXT NOT NULL DEFAULT ''")
+    _add_column(cursor, 'queue_events', 'guild_id', "TEXT NOT NULL DEFAULT ''")
+
+    # Superseded by the guild-leading indexes below
+    cursor.execute('DROP INDEX IF EXISTS idx_queue_pending_user')
+    cursor.execute('DROP INDEX IF EXISTS idx_queue_pending_age')
+    # Covers the pending-per-category scan and the per-user partitions of fair-share ordering
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_guild_pending_user
+        ON queue (guild_id, status, category, added_by, added_date)
+    ''')
+    # Oldest-first pending items of one guild's category
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_guild_pending_age
+        ON queue (guild_id, status, category, added_date)
+    ''')
+
+
+def _seed_change_feed(cursor, last_key, batch_size: int):
+    """Give pending items that predate the change feed an 'add' event, in id order"""
+    last_id = int(last_key or 0)
+    cursor.execute('''
+        SELECT id FROM queue
+        WHERE id > ? AND status = 'pending'
+        ORDER BY id
+        LIMIT ?
+    ''', (last_id, batch_size))
+    item_ids = [row[0] for row in cursor.fetchall()]
+    if not item_ids:
+        return None
+    cursor.execute(f'''
+        INSERT INTO queue_events (event, item_id, category, guild_id)
+        SELECT 'add', q.id, q.category, q.guild_id
+        FROM queue q
+        WHERE q.id IN ({','.join('?' * len(item_ids))})
+          AND NOT EXISTS (SELECT 1 FROM queue_events e WHERE e.item_id = q.id)
+        ORDER BY q.id
+    ''', item_ids)
+    return str(item_ids[-1])
+
+
+def _create_embed_mirrors(cursor):
+    # Extra channels showing a copy of a guild's category queue embed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embed_mirrors (
+            guild_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            PRIMARY KEY (guild_id, category, message_id)
+        )
+    ''')
+
+
+def _create_categories(cursor):
+    # Queue categories; position orders embeds, usage strings and help
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO categories (name, position) VALUES (?, ?)',
+                       [('show', 1), ('movie', 2), ('anime', 3)])
+
+
+def _index_pending_age(cursor):
+    # The TTL sweeper expires a category across all guilds, oldest first, so it needs
+    # an index without a leading guild_id to batch through added_date without a sort
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_pending_age
+        ON queue (status, category, added_date)
+    ''')
+
+
+def _index_fair_share_turns(cursor):
+    # Fair-share ordering partitions by (is_downloading, added_by); with is_downloading
+    # ahead of added_by the index yields the window's partitions already sorted
+    cursor.execute('DROP INDEX IF EXISTS idx_queue_guild_pending_user')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_guild_pending_turn
+        ON queue (guild_id, status, category, is_downloading, added_by, added_date)
+    ''')
+
+
+def _seed_user_actions(cursor, last_key, batch_size: int):
+    """Give pending items that predate the action log an undoable 'add' for their requester"""
+    last_id = int(last_key or 0)
+    cursor.execute('''
+        SELECT id FROM queue
+        WHERE id > ? AND status = 'pending'
+        ORDER BY id
+        LIMIT ?
+    ''', (last_id, batch_size))
+    item_ids = [row[0] for row in cursor.fetchall()]
+    if not item_ids:
+        return None
+    # Offsetting the id keeps seeded adds in request order and below every logged action (seq >= 1)
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO user_actions (user_id, seq, action, item_id)
+        SELECT q.added_by, q.id - {SEEDED_ACTION_OFFSET}, 'add', q.id
+        FROM queue q
+        WHERE q.id IN ({','.join('?' * len(item_ids))})
+          AND NOT EXISTS (
+              SELECT 1 FROM user_actions a
+              WHERE a.user_id = q.added_by AND a.seq >= 1 AND a.item_id = q.id AND a.action = 'add'
+          )
+    ''', item_ids)
+    return str(item_ids[-1])
+
+
+MIGRATIONS = [
+    Migration(1, 'base queue and users tables', _create_base_tables),
+    Migration(2, 'per-user action log', _create_user_actions),
+    Migration(3, 'queue change feed', _create_change_feed),
+    Migration(4, 'guild partitioning', _partition_by_guild),
+    Migration(5, 'index change feed by item', lambda cursor: cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_queue_events_item ON queue_events (item_id)')),
+    BatchedMigration(6, 'seed change feed with existing pending items', _seed_change_feed),
+    Migration(7, 'queue embed mirrors', _create_embed_mirrors),
+    Migration(8, 'category registry', _create_categories),
+    Migration(9, 'restore cross-guild pending age index', _index_pending_age),
+    Migration(10, 'index fair-share turns by download state', _index_fair_share_turns),
+    BatchedMigration(11, 'seed undo log with existing pending items', _seed_user_actions),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _run_batched(conn, migration: BatchedMigration, batch_size: int, pause: float):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            version INTEGER PRIMARY KEY,
+            last_key TEXT
+        )
+    ''')
+    row = conn.execute('SELECT last_key FROM migration_progress WHERE version = ?',
+                       (migration.version,)).fetchone()
+    last_key = row[0] if row else None
+    while True:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            next_key = migration.apply(cursor, last_key, batch_size)
+            if next_key is None:
+                cursor.execute('DELETE FROM migration_progress WHERE version = ?', (migration.version,))
+                cursor.execute(f'PRAGMA user_version = {migration.version}')
+            else:
+                cursor.execute('''
+                    INSERT INTO migration_progress (version, last_key) VALUES (?, ?)
+                    ON CONFLICT(version) DO UPDATE SET last_key = excluded.last_key
+                ''', (migration.version, next_key))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        if next_key is None:
+            return
+        last_key = next_key
+        # Give other connections a chance to take the write lock between batches
+        time.sleep(pause)
+
+
+def migrate(db_path: str, batch_size: int = BATCH_SIZE, pause: float = 0.01) -> int:
+    """Apply any pending migrations and return the resulting schema version"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = get_version(conn)
+        if version >= LATEST_VERSION:
+            return version
+
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            logger.info("Migrating %s to schema v%d: %s", db_path, migration.version, migration.description)
+            if isinstance(migration, BatchedMigration):
+                _run_batched(conn, migration, batch_size, pause)
+            else:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    migration.apply(cursor)
+                    cursor.execute(f'PRAGMA user_version = {migration.version}')
+                    cursor.execute('COMMIT')
+                except Exception:
+                    cursor.execute('ROLLBACK')
+                    raise
+            version = migration.version
+        return version
+    finally:
+        conn.close()
+
+
+def _main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Show or apply queue database schema migrations')
+    parser.add_argument('--db', default=os.getenv('QUEUE_DB_PATH', 'queue.db'))
+    parser.add_argument('--status', action='store_true', help='print the schema version without migrating')
+    args = parser.parse_args(argv)
+
+    if args.status:
+        conn = sqlite3.connect(args.db)
+        try:
+            print(f"{args.db}: schema v{get_version(conn)} (latest v{LATEST_VERSION})")
+        finally:
+            conn.close()
+        return 0
+    print(f"{args.db}: schema v{migrate(args.db)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
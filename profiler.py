@@ -0,0 +1,73 @@
+"""On-demand cProfile capture of the bot's event loop thread.
+
+cProfile only sees the thread that enables it; everything the bot does on the
+event loop (command handlers, QueueDatabase calls made inline, embed renders)
+is captured, while work pushed to worker threads via asyncio.to_thread is not.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+from datetime import datetime
+
+# Source files whose functions are listed separately in the summary
+PROJECT_FILES = ('main.py', 'database.py', 'backup.py', 'metrics.py', 'migrations.py', 'worker.py', 'categories.py')
+
+_active = False
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another is still running"""
+
+
+def _is_project_function(func) -> bool:
+    filename = func[0]
+    return os.path.basename(filename) in PROJECT_FILES
+
+
+def _format_rows(stats: pstats.Stats, rows: list) -> list:
+    lines = []
+    for func in rows:
+        calls, _, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        location = f"{os.path.basename(filename)}:{line}" if line else filename
+        lines.append(f"{cumtime:8.3f}s cum {tottime:8.3f}s self {calls:>7}  {name} ({location})")
+    return lines
+
+
+def summarize(stats: pstats.Stats, top_n: int = 10) -> str:
+    """Top project functions by cumulative time, then top functions overall by self time"""
+    by_cumulative = sorted(stats.stats, key=lambda func: stats.stats[func][3], reverse=True)
+    by_self = sorted(stats.stats, key=lambda func: stats.stats[func][2], reverse=True)
+    project = [func for func in by_cumulative if _is_project_function(func)][:top_n]
+
+    lines = [f"Profiled {stats.total_tt:.3f}s on the event loop thread (idle time shows up as epoll/select)", '', 'Bot code (cumulative):']
+    lines.extend(_format_rows(stats, project) or ['  (no bot code ran)'])
+    lines.append('')
+    lines.append('Hottest functions (self):')
+    lines.extend(_format_rows(stats, by_self[:top_n]))
+    return '\n'.join(lines)
+
+
+async def profile_for(seconds: float, out_dir: str = 'profiles', top_n: int = 10):
+    """Profile the event loop thread for `seconds`; returns (stats file path, text summary)"""
+    global _active
+    if _active:
+        raise ProfilerBusy("A profile is already running")
+    _active = True
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+    finally:
+        _active = False
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof")
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    stats.dump_stats(path)
+    return path, summarize(stats, top_n)
@@ -0,0 +1,416 @@
+"""Record-and-replay load generator for the queue bot.
+
+Feeds a JSONL message stream (or a synthetic one) through ``main.on_message``
+and the registered commands (with their checks and argument converters), against
+a local fake of the Discord HTTP layer that simulates request latency and
+per-route 429 rate limits.
+
+Each input line is a JSON object:
+    {"content": "Breaking Bad (show)", "author_id": "42", "author_name": "bob",
+     "channel_id": 1, "admin": false, "owner": false, "at": 0.25}
+Only ``content`` is required; ``at`` is the offset in seconds from the start of
+the recording and is ignored when ``--rate`` is given.
+
+Usage:
+    python replay.py recorded.jsonl --rate 5,20,50
+    python replay.py --synthetic 500 --rate 10,25,50,100 --latency-ms 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+# Keep the replay away from the live database and from the live log file
+# before main.py is imported and builds its module-level state.
+_workdir = tempfile.mkdtemp(prefix='queue-replay-')
+os.environ.setdefault('QUEUE_DB_PATH', os.path.join(_workdir, 'queue.db'))
+os.environ.setdefault('LOG_FILE', os.path.join(_workdir, 'replay.log'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import main  # noqa: E402
+from database import QueueDatabase  # noqa: E402
+
+# Tags used in synthetic streams; a fresh replay database registers these by default
+CATEGORIES = ['show', 'movie', 'anime']
+
+# Captured before any run wraps it, so repeated runs don't nest timing wrappers
+_ORIGINAL_UPDATE = main.update_queue_embed
+
+# Route -> (requests allowed, per seconds). Roughly Discord's per-channel buckets.
+DEFAULT_RATE_LIMITS = {
+    'add_reaction': (1, 0.25),
+    'delete_message': (5, 1.0),
+    'edit_message': (5, 5.0),
+    'send_message': (5, 5.0),
+}
+
+
+class FakeTransport:
+    """Stand-in for Discord's HTTP layer: latency, per-bucket rate limits and call accounting.
+
+    Like discord.py, requests to one bucket queue behind a lock, so a 429 holds up only
+    that bucket and each request is counted once however often it is retried.
+    """
+
+    def __init__(self, latency_ms: float = 80.0, jitter_ms: float = 20.0, rate_limits: dict = None):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rate_limits = rate_limits or DEFAULT_RATE_LIMITS
+        self.calls = defaultdict(int)
+        self.rate_limited = defaultdict(int)
+        self._windows = defaultdict(list)
+        self._locks = defaultdict(asyncio.Lock)
+
+    async def request(self, route: str, bucket: str):
+        """Simulate one HTTP request, retrying after a 429 the way discord.py does"""
+        limit, per = self.rate_limits.get(route, (50, 1.0))
+        key = (route, bucket)
+        self.calls[route] += 1
+        async with self._locks[key]:
+            while True:
+                now = time.perf_counter()
+                window = [t for t in self._windows[key] if now - t < per]
+                self._windows[key] = window
+                if len(window) < limit:
+                    window.append(now)
+                    break
+                self.rate_limited[route] += 1
+                retry_after = per - (now - window[0])
+                await asyncio.sleep(max(retry_after, 0.0) + self._delay())
+        await asyncio.sleep(self._delay())
+
+    def _delay(self) -> float:
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+
+# Every replayed message arrives in this guild
+REPLAY_GUILD_ID = 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakePermissions:
+    def __init__(self, administrator: bool):
+        self.administrator = administrator
+
+
+class FakeAuthor:
+    def __init__(self, user_id: str, name: str, admin: bool = False):
+        self.id = int(user_id) if str(user_id).isdigit() else user_id
+        self.name = name
+        self.guild_permissions = FakePermissions(admin)
+
+
+class FakeMessage:
+    def __init__(self, transport: FakeTransport, channel, content: str = '', author=None, embed=None, guild=None):
+        self.transport = transport
+        self.channel = channel
+        self.content = content
+        self.author = author
+        self.embed = embed
+        self.id = random.getrandbits(48)
+        self.guild = guild
+        self.acked_at = None
+        self.attachments = []
+        self._state = None
+
+    async def add_reaction(self, emoji):
+        await self.transport.request('add_reaction', str(self.channel.id))
+        if self.acked_at is None:
+            self.acked_at = time.perf_counter()
+
+    async def delete(self):
+        await self.transport.request('delete_message', str(self.channel.id))
+        if self.acked_at is None:
+            self.acked_at = time.perf_counter()
+
+    async def edit(self, embed=None, **kwargs):
+        await self.transport.request('edit_message', str(self.channel.id))
+        self.embed = embed
+
+
+class FakeChannel:
+    def __init__(self, transport: FakeTransport, channel_id: int):
+        self.transport = transport
+        self.id = channel_id
+        self.mention = f'<#{channel_id}>'
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await self.transport.request('send_message', str(self.id))
+        return FakeMessage(self.transport, self, content or '', embed=embed)
+
+    async def fetch_message(self, message_id):
+        return FakeMessage(self.transport, self)
+
+
+class FakeContext(commands.Context):
+    """Real command context whose replies go through the fake transport"""
+
+    async def send(self, content=None, embed=None, **kwargs):
+        msg = await self.channel.send(content, embed=embed)
+        if self.message.acked_at is None:
+            self.message.acked_at = time.perf_counter()
+        return msg
+
+
+class ReplayRun:
+    """One replay pass at a fixed message rate against a fresh database"""
+
+    def __init__(self, messages: list, rate: float, transport: FakeTransport, mirrors: int = 0):
+        self.messages = messages
+        self.rate = rate
+        self.transport = transport
+        self.mirrors = mirrors
+        self.ack_latencies = []
+        self.staleness = []
+        self.command_errors = 0
+        self.commands_denied = 0
+        self.unacked = 0
+        self._unrendered = defaultdict(list)
+        self.guild = FakeGuild(REPLAY_GUILD_ID)
+        self._owners = {FakeAuthor(entry.get('author_id', '1'), '').id for entry in messages if entry.get('owner')}
+
+    async def _install(self):
+        """Point main.py's module state at the fake transport and a fresh database"""
+        db_path = os.path.join(_workdir, f'queue-{time.time_ns()}.db')
+        main.db = QueueDatabase(db_path)
+        await main.load_categories()
+        guild_id = str(REPLAY_GUILD_ID)
+        main.guild_settings[guild_id] = {}
+        main.auto_delete_channels = set()
+        main.queue_messages[guild_id] = {
+            category: FakeMessage(self.transport, FakeChannel(self.transport, 1000 + index))
+            for index, category in enumerate(main.categories)
+        }
+        # Each mirror sits in its own channel, so its edits have their own rate-limit bucket
+        main.mirror_messages[guild_id] = {
+            category: [FakeMessage(self.transport, FakeChannel(self.transport, 2000 + 100 * index + mirror))
+                       for mirror in range(self.mirrors)]
+            for index, category in enumerate(main.categories)
+        }
+
+        unrendered = self._unrendered
+        staleness = self.staleness
+
+        async def timed_update_queue_embed(guild_id: str, category: str = None):
+            started = time.perf_counter()
+            await _ORIGINAL_UPDATE(guild_id, category)
+            finished = time.perf_counter()
+            for cat in ([category.lower()] if category else main.categories):
+                pending = unrendered[cat]
+                fresh = [t for t in pending if t > started]
+                staleness.extend(finished - t for t in pending if t <= started)
+                unrendered[cat] = fresh
+
+        main.update_queue_embed = timed_update_queue_embed
+        main.bot.process_commands = self._process_commands
+        main.bot.is_owner = self._is_owner
+        main.bot.wait_until_ready = self._wait_until_ready
+
+    async def _wait_until_ready(self):
+        # The fake transport never connects, so there is no READY to wait for
+        return
+
+    async def _is_owner(self, user) -> bool:
+        # The real check asks Discord for the application's owner
+        return user.id in self._owners
+
+    async def _process_commands(self, message: FakeMessage):
+        if not message.content.startswith('!'):
+            return
+        name, _, arg_text = message.content[1:].partition(' ')
+        command = main.bot.get_command(name.lower())
+        if command is None:
+            return
+        ctx = FakeContext(message=message, bot=main.bot, view=StringView(arg_text), prefix='!',
+                          command=command, invoked_with=name)
+        # Command.invoke runs the checks and converters; errors go to the bot's handler as in production
+        try:
+            await command.invoke(ctx)
+        except commands.CommandError as e:
+            if isinstance(e, commands.CheckFailure):
+                self.commands_denied += 1
+            else:
+                self.command_errors += 1
+            try:
+                await main.on_command_error(ctx, e)
+            except Exception:
+                pass
+        except Exception:
+            self.command_errors += 1
+
+    async def _deliver(self, entry: dict, channel: FakeChannel):
+        author = FakeAuthor(entry.get('author_id', '1'), entry.get('author_name', 'replay'), entry.get('admin', False))
+        message = FakeMessage(self.transport, channel, entry['content'], author=author, guild=self.guild)
+        injected = time.perf_counter()
+        category, _ = main.categories.classify(entry['content'])
+        if category:
+            self._unrendered[category].append(injected)
+        await main.on_message(message)
+        if message.acked_at is not None:
+            self.ack_latencies.append(message.acked_at - injected)
+        else:
+            self.unacked += 1
+
+    async def run(self) -> dict:
+        await self._install()
+        refresher = asyncio.create_task(main.embed_refresh_loop())
+        channels = {}
+        tasks = []
+        started = time.perf_counter()
+        for index, entry in enumerate(self.messages):
+            due = index / self.rate if self.rate else float(entry.get('at', 0.0))
+            delay = started + due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            channel_id = int(entry.get('channel_id', 1))
+            channel = channels.setdefault(channel_id, FakeChannel(self.transport, channel_id))
+            # discord.py dispatches each gateway event in its own task
+            tasks.append(asyncio.create_task(self._deliver(entry, channel)))
+        await asyncio.gather(*tasks)
+        # Let the change-feed refresher draw the last mutations
+        await asyncio.sleep(0.05)
+        while not main.feed_idle.is_set():
+            await asyncio.sleep(0.01)
+        refresher.cancel()
+        elapsed = time.perf_counter() - started
+        never_rendered = sum(len(v) for v in self._unrendered.values())
+        return {
+            'rate': self.rate,
+            'messages': len(self.messages),
+            'elapsed_s': elapsed,
+            'throughput': len(self.messages) / elapsed if elapsed else 0.0,
+            'ack_ms': _summarize(self.ack_latencies),
+            'staleness_ms': _summarize(self.staleness),
+            'unacked': self.unacked,
+            'never_rendered': never_rendered,
+            'command_errors': self.command_errors,
+            'commands_denied': self.commands_denied,
+            'api_calls': dict(self.transport.calls),
+            'rate_limited': dict(self.transport.rate_limited),
+        }
+
+
+def _summarize(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered) * 1000.0,
+        'p50': pct(0.50),
+        'p95': pct(0.95),
+        'p99': pct(0.99),
+        'max': ordered[-1] * 1000.0,
+    }
+
+
+def load_messages(path: str) -> list:
+    """Read a JSONL recording, skipping blank lines and entries without content"""
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry.get('content'):
+                messages.append(entry)
+    return messages
+
+
+def synthesize_messages(count: int, users: int, command_ratio: float, seed: int = None) -> list:
+    """Generate a request stream with a sprinkling of admin commands"""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        user = rng.randrange(users)
+        if rng.random() < command_ratio:
+            category = rng.choice(CATEGORIES)
+            content = rng.choice([f'!toggledl 1 {category}', f'!remove 1 {category}', f'!refresh {category}'])
+            messages.append({'content': content, 'author_id': '1', 'author_name': 'admin', 'admin': True})
+        else:
+            category = rng.choice(CATEGORIES)
+            messages.append({
+                'content': f'Title {index} ({category})',
+                'author_id': str(1000 + user),
+                'author_name': f'user{user}',
+            })
+    return messages
+
+
+def format_report(result: dict) -> str:
+    def row(label, stats):
+        if not stats:
+            return f"  {label:<14} n/a"
+        return (f"  {label:<14} n={stats['count']:<6} mean={stats['mean']:8.1f}ms p50={stats['p50']:8.1f}ms "
+                f"p95={stats['p95']:8.1f}ms p99={stats['p99']:8.1f}ms max={stats['max']:8.1f}ms")
+
+    rate = f"{result['rate']:g} msg/s" if result['rate'] else 'recorded timing'
+    lines = [
+        f"== {rate}: {result['messages']} messages in {result['elapsed_s']:.2f}s "
+        f"({result['throughput']:.1f} msg/s achieved)",
+        row('ack latency', result['ack_ms']),
+        row('embed stale', result['staleness_ms']),
+        f"  unacked={result['unacked']} never_rendered={result['never_rendered']} "
+        f"command_errors={result['command_errors']} commands_denied={result['commands_denied']}",
+        '  api calls: ' + ', '.join(f"{route}={count}" for route, count in sorted(result['api_calls'].items())),
+        '  429s:      ' + (', '.join(f"{route}={count}" for route, count in sorted(result['rate_limited'].items())) or 'none'),
+    ]
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Replay message streams through the bot against a fake Discord transport')
+    parser.add_argument('recording', nargs='?', help='JSONL file of messages to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='generate N synthetic messages instead of reading a file')
+    parser.add_argument('--users', type=int, default=20, help='distinct users in synthetic streams')
+    parser.add_argument('--command-ratio', type=float, default=0.05, help='fraction of synthetic messages that are admin commands')
+    parser.add_argument('--rate', default='', help='comma-separated message rates (msg/s) to sweep; omit to use recorded timing')
+    parser.add_argument('--latency-ms', type=float, default=80.0, help='mean simulated API latency')
+    parser.add_argument('--jitter-ms', type=float, default=20.0, help='stddev of simulated API latency')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for synthetic streams and latency')
+    parser.add_argument('--mirrors', type=int, default=0, help='mirrored copies of each queue embed')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    return parser.parse_args(argv)
+
+
+async def run_replay(args) -> list:
+    if args.recording:
+        messages = load_messages(args.recording)
+    elif args.synthetic:
+        messages = synthesize_messages(args.synthetic, args.users, args.command_ratio, args.seed)
+    else:
+        raise SystemExit('Provide a recording file or --synthetic N')
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    rates = [float(r) for r in args.rate.split(',') if r.strip()] or [0.0]
+    results = []
+    for rate in rates:
+        transport = FakeTransport(args.latency_ms, args.jitter_ms)
+        results.append(await ReplayRun(messages, rate, transport, args.mirrors).run())
+    return results
+
+
+if __name__ == '__main__':
+    parsed = parse_args()
+    for outcome in asyncio.run(run_replay(parsed)):
+        print(json.dumps(outcome) if parsed.json else format_report(outcome))
+    sys.stdout.flush()
@@ -0,0 +1,335 @@
+"""Optional split-process mode: a worker process owns QueueDatabase, the bot process only talks to Discord.
+
+With WORKER_MODE=process, main.py starts this module as a child process and swaps its
+QueueDatabase for a WorkerDatabase. Every database call is pickled over a local Unix
+socket (multiprocessing.connection), executed in the worker, and the result or
+exception is sent back. The worker uses its own core and its own GIL, so SQLite work
+and maintenance never compete with the gateway heartbeat.
+
+Inside the worker, quick interactive calls are answered in order on the main thread,
+while maintenance jobs (MAINTENANCE_METHODS) run on a separate thread so a long sweep
+or snapshot never queues up behind or in front of a user's command.
+
+Usage (normally launched by main.py):
+    WORKER_AUTHKEY=... python worker.py --socket /tmp/queue-worker.sock [--db queue.db] [--fair-share show,anime]
+"""
+import argparse
+import asyncio
+import copy
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+from backup import create_snapshot
+from database import ChangeSubscription, QueueDatabase
+
+logger = logging.getLogger(__name__)
+
+# Long-running calls that get their own lane in the worker
+MAINTENANCE_METHODS = {'expire_stale_items', 'adopt_legacy_rows', 'create_snapshot', 'trim_change_feed'}
+# Calls that write change-feed events; local subscribers are woken when one completes
+MUTATING_METHODS = {
+    'add_to_queue', 'remove_from_queue', 'clear_queue', 'expire_stale_items', 'undo_actions',
+    'undo_last_entry', 'set_status_note', 'clear_status_note', 'toggle_downloading',
+}
+# Calls the worker runs that are not QueueDatabase methods
+JOBS = {'create_snapshot': create_snapshot}
+# What each QueueDatabase method returns when its own query fails; a call the worker
+# cannot answer returns the same, so callers need no extra error handling in split mode.
+# Calls not listed here raise instead: ping, get_ordering, create_snapshot, and the reads
+# whose results the gateway caches (get_guild_settings, get_categories, get_embed_mirrors),
+# so a restart or timeout is never cached as "no settings" or "no mirrors".
+FAILURE_RESULTS = {
+    'get_events_since': [], 'latest_event_seq': 0, 'trim_change_feed': 0,
+    'add_to_queue': None, 'get_queue': [], 'remove_from_queue': False, 'clear_queue': 0,
+    'expire_stale_items': (0, set()), 'get_item': None, 'undo_actions': [], 'undo_last_entry': None,
+    'get_user_stats': None, 'get_queue_stats': {}, 'set_status_note': False, 'clear_status_note': False,
+    'toggle_downloading': False, 'set_ordering': None, 'get_settings_like': [],
+    'set_guild_setting': False, 'delete_guild_settings': 0, 'delete_guild_setting_keys': 0,
+    'add_category': False, 'remove_category': False, 'add_embed_mirror': False,
+    'remove_embed_mirrors': 0, 'adopt_legacy_rows': 0,
+}
+# Sent once the worker has migrated the database and is ready for calls
+READY = 'ready'
+
+
+class WorkerUnavailable(Exception):
+    """Raised when the worker process has exited or never came up"""
+
+
+def serve(socket_path: str, authkey: bytes, db_path: str, fair_share_categories=None):
+    """Accept one gateway connection and answer its requests until it disconnects"""
+    with Listener(socket_path, family='AF_UNIX', authkey=authkey) as listener:
+        logger.info("Worker listening on %s (pid %d)", socket_path, os.getpid())
+        conn = listener.accept()
+
+    # Migrating a large database can take minutes; the gateway waits for READY meanwhile
+    db = QueueDatabase(db_path, fair_share_categories)
+    maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix='maintenance')
+    send_lock = threading.Lock()
+    conn.send(READY)
+
+    def execute(request_id, name, args, kwargs):
+        try:
+            if name.startswith('_'):
+                raise AttributeError(f"{name} is not a public QueueDatabase method")
+            handler = JOBS.get(name) or getattr(db, name)
+            reply = (request_id, True, handler(*args, **kwargs))
+        except Exception as e:
+            logger.exception("Worker call %s failed", name)
+            reply = (request_id, False, e)
+        with send_lock:
+            try:
+                conn.send(reply)
+            except OSError:
+                pass  # the gateway went away; the main loop sees EOF and stops
+            except Exception as e:
+                # The result or exception may not pickle; report it as text instead
+                conn.send((request_id, False, WorkerUnavailable(f"{name} failed: {reply[2]!r} ({e})")))
+
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                break
+            if request is None:
+                break
+            request_id, name, args, kwargs = request
+            if name in MAINTENANCE_METHODS:
+                maintenance.submit(execute, request_id, name, args, kwargs)
+            else:
+                execute(request_id, name, args, kwargs)
+    finally:
+        maintenance.shutdown(wait=True)
+        conn.close()
+        logger.info("Worker stopped")
+
+
+class WorkerDatabase:
+    """QueueDatabase stand-in for the gateway process; forwards every call to the worker.
+
+    Async code should await call_async(), which never blocks the event loop. Plain
+    attribute calls (db.get_queue_stats(...)) block for the round trip and are meant for
+    threads. A call that fails, times out or finds the worker down returns the same value
+    QueueDatabase returns on error (FAILURE_RESULTS), or raises WorkerUnavailable for calls
+    without one; a dead worker is restarted in the background and calls fail fast until
+    it is back.
+    """
+
+    def __init__(self, db_path: str = 'queue.db', fair_share_categories=None, timeout: float = 30.0,
+                 restart_delay: float = 5.0):
+        self.db_path = db_path
+        self.fair_share_categories = set(fair_share_categories or ())
+        self.timeout = timeout
+        self.restart_delay = restart_delay
+        self.process = None
+        self._conn = None
+        self._socket_dir = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._subscriptions = []
+
+    def start(self, startup_timeout: float = 15.0):
+        """Launch the worker process and wait until it has migrated the database.
+
+        startup_timeout bounds only the connect; migrations may take as long as they need
+        while the worker process is alive.
+        """
+        self._socket_dir = tempfile.mkdtemp(prefix='queue-worker-')
+        socket_path = os.path.join(self._socket_dir, 'worker.sock')
+        authkey = os.urandom(16)
+        command = [sys.executable, os.path.abspath(__file__), '--socket', socket_path, '--db', self.db_path]
+        if self.fair_share_categories:
+            command += ['--fair-share', ','.join(sorted(self.fair_share_categories))]
+        env = dict(os.environ, WORKER_AUTHKEY=authkey.hex())
+        self.process = subprocess.Popen(command, env=env)
+
+        deadline = time.monotonic() + startup_timeout
+        conn = None
+        while conn is None:
+            if self.process.poll() is not None:
+                raise WorkerUnavailable(f"Worker exited during startup with code {self.process.returncode}")
+            try:
+                conn = Client(socket_path, family='AF_UNIX', authkey=authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    self.process.kill()
+                    raise WorkerUnavailable("Worker did not come up in time")
+                time.sleep(0.05)
+        try:
+            conn.recv()  # READY, after migrations
+        except (EOFError, OSError):
+            conn.close()
+            raise WorkerUnavailable(f"Worker exited during startup with code {self.process.wait()}")
+        self._conn = conn
+        threading.Thread(target=self._read_replies, name='worker-replies', daemon=True).start()
+        logger.info("Started database worker (pid %d)", self.process.pid)
+
+    def _read_replies(self):
+        while True:
+            try:
+                request_id, ok, value = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future, name = self._pending.pop(request_id, (None, None))
+            if future is None:
+                continue
+            try:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            except InvalidStateError:
+                pass  # the caller timed out and cancelled it
+            if name in MUTATING_METHODS:
+                for subscription in list(self._subscriptions):
+                    subscription._notify()
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            conn, self._conn = self._conn, None
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(WorkerUnavailable("Worker connection closed"))
+        if not self._closing:
+            logger.warning("Lost connection to the database worker")
+            conn.close()
+            self._restart()
+
+    def _restart(self):
+        """Replace a worker that died; runs on the reply thread until a new one is up"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self._socket_dir:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+        while not self._closing:
+            try:
+                self.start()
+            except Exception as e:
+                logger.error("Could not restart the database worker: %s", e)
+                time.sleep(self.restart_delay)
+                continue
+            # Let subscribers catch up on anything committed before the crash
+            for subscription in list(self._subscriptions):
+                subscription._notify()
+            return
+
+    def submit(self, name: str, *args, **kwargs) -> Future:
+        """Send a call to the worker and return a Future for its result"""
+        if self._conn is None:
+            raise WorkerUnavailable("Worker is not running")
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, name)
+            try:
+                self._conn.send((request_id, name, args, kwargs))
+            except (OSError, ValueError) as e:
+                del self._pending[request_id]
+                raise WorkerUnavailable(f"Could not reach worker: {e}")
+        return future
+
+    def _timeout_for(self, name: str):
+        # Maintenance jobs may legitimately run for minutes
+        return None if name in MAINTENANCE_METHODS else self.timeout
+
+    def _failed(self, name: str, error: Exception):
+        if name not in FAILURE_RESULTS:
+            if isinstance(error, TimeoutError):
+                raise WorkerUnavailable(f"Worker did not answer {name} within {self._timeout_for(name)}s")
+            raise error
+        logger.error("Worker call %s failed: %r", name, error)
+        return copy.deepcopy(FAILURE_RESULTS[name])
+
+    def call(self, name: str, *args, **kwargs):
+        """Blocking call; for threads, not the event loop"""
+        try:
+            return self.submit(name, *args, **kwargs).result(self._timeout_for(name))
+        except Exception as e:
+            return self._failed(name, e)
+
+    async def call_async(self, name: str, *args, **kwargs):
+        try:
+            future = asyncio.wrap_future(self.submit(name, *args, **kwargs))
+            return await asyncio.wait_for(future, self._timeout_for(name))
+        except Exception as e:
+            return self._failed(name, e)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(QueueDatabase, name, None)
+        if not callable(method):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def subscribe(self, from_seq: int = None, on_change=None) -> ChangeSubscription:
+        """Tail the worker's change feed; poll() fetches events over the socket.
+
+        on_change fires when a mutating call made through this proxy completes.
+        """
+        if from_seq is None:
+            from_seq = self.call('latest_event_seq')
+        subscription = ChangeSubscription(self, from_seq, on_change)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChangeSubscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def close(self, timeout: float = 10.0):
+        """Ask the worker to finish outstanding jobs and exit"""
+        self._closing = True
+        conn = self._conn
+        if conn is not None:
+            try:
+                with self._lock:
+                    conn.send(None)
+            except OSError:
+                pass
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Worker did not exit in time; terminating it")
+                self.process.terminate()
+        if conn is not None:
+            conn.close()
+            self._conn = None
+        if self._socket_dir:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+
+def _main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Serve queue database calls for a gateway process')
+    parser.add_argument('--socket', required=True, help='Unix socket path to listen on')
+    parser.add_argument('--db', default=os.getenv('QUEUE_DB_PATH', 'queue.db'))
+    parser.add_argument('--fair-share', default='', help='comma-separated categories that default to fair-share ordering')
+    args = parser.parse_args(argv)
+
+    from logging_config import setup_logging
+    setup_logging(os.getenv('WORKER_LOG_FILE', 'worker.log'))
+    authkey = bytes.fromhex(os.environ['WORKER_AUTHKEY'])
+    fair_share = [cat.strip().lower() for cat in args.fair_share.split(',') if cat.strip()]
+    serve(args.socket, authkey, args.db, fair_share)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())